@@ -86,7 +86,7 @@ while [[ $# -gt 0 ]]; do
         else
             echo "$1 $2 $3"
             pvalue_col="$3"
-            sfhit 3
+            shift 3
         fi
         ;;
     -o | --out)
@@ -163,10 +163,10 @@ if [[ ${cutoff} -eq 0 ]]; then
 
 else
     if [[ "${input_file##*.}" == "gz" ]]; then
-        zcat ${input_file} | snpID2bed.py -i ${snp_col} --no-chr | awk -v cutoff=${cutoff} -v p_col=${pvalue_col} 'NR==1{print;next}{if($(p_col+5) > cutoff){print}}' >${filterInputFile}
+        zcat ${input_file} | snpID2bed.py -i ${snp_col} --no-chr --pval-col ${pvalue_col} --cutoff ${cutoff} >${filterInputFile}
 
     else
-        cat ${input_file} | snpID2bed.py -i ${snp_col} --no-chr | awk -v cutoff=${cutoff} -v p_col=${pvalue_col} 'NR==1{print;next}{if($(p_col+5) > cutoff){print}}' >${filterInputFile}
+        cat ${input_file} | snpID2bed.py -i ${snp_col} --no-chr --pval-col ${pvalue_col} --cutoff ${cutoff} >${filterInputFile}
     fi
 fi
 cat ${filterInputFile} | awk '{print $1,$2}' >${posFile}
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import argparse
+import os.path as osp
+import tempfile
+import textwrap
+import time
+
+import numpy as np
+import pandas as pd
+
+from compareGWAS import load_bolt, resetSNP, resetSNP_column
+
+
+def getParser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(
+            """
+        %prog benchmark the --resetID path of compareGWAS.load_bolt, the old bolt.apply(resetSNP, axis=1) vs resetSNP_column
+        @Author: xutingfeng@big.ac.cn
+        Version: 1.0
+        Example:
+        1. 5M rows: ./bench_compareGWAS.py
+        2. 1M rows and keep the BOLT file: ./bench_compareGWAS.py -n 1000000 -o bolt.stats
+
+        """
+        ),
+    )
+    parser.add_argument("-n", dest="n", default=5000000, type=int, help="rows of the synthetic BOLT file, default 5000000")
+    parser.add_argument("-o", "--output", dest="output", default=None, help="path of the synthetic BOLT file, default is a temporary file")
+    parser.add_argument("--seed", dest="seed", default=0, type=int, help="random seed")
+    return parser
+
+
+def synthetic_bolt(n, seed=0):
+    """
+    BOLT-LMM output of n rows, the position in SNP is not the one in BP like the IDs of another build.
+    """
+    rng = np.random.default_rng(seed)
+    chrom = np.sort(rng.integers(1, 23, n))
+    bp = rng.integers(1, 250000000, n)
+    old_bp = bp + rng.integers(-100000, 100000, n)
+    alleles = np.array(["A", "C", "G", "T"])
+    a1 = alleles[rng.integers(0, 4, n)]
+    a0 = alleles[rng.integers(0, 4, n)]
+    return pd.DataFrame(
+        {
+            "SNP": [f"{c}:{p}:{x}:{y}" for c, p, x, y in zip(chrom, old_bp, a0, a1)],
+            "CHR": chrom,
+            "BP": bp,
+            "GENPOS": 0,
+            "ALLELE1": a1,
+            "ALLELE0": a0,
+            "A1FREQ": rng.random(n).round(4),
+            "F_MISS": 0,
+            "BETA": rng.normal(0, 0.01, n).round(5),
+            "SE": 0.01,
+            "P_BOLT_LMM_INF": rng.uniform(1e-4, 1, n).round(4),
+            "P_BOLT_LMM": rng.uniform(1e-4, 1, n).round(4),
+        }
+    )
+
+
+if __name__ == "__main__":
+    parser = getParser()
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.output if args.output else osp.join(tmp, "bolt.stats")
+        start = time.time()
+        synthetic_bolt(args.n, args.seed).to_csv(path, sep="\t", index=False)
+        print(f"write {args.n} rows to {path} in {time.time() - start:.1f}s")
+
+        bolt = pd.read_csv(path, sep="\t", usecols=["SNP", "BP"])
+
+        start = time.time()
+        old = bolt.apply(resetSNP, axis=1)
+        old_time = time.time() - start
+        print(f"old bolt.apply(resetSNP, axis=1): {old_time:.2f}s")
+
+        start = time.time()
+        new = resetSNP_column(bolt["SNP"], bolt["BP"])
+        new_time = time.time() - start
+        print(f"new resetSNP_column: {new_time:.2f}s, {old_time / new_time:.1f}x faster")
+
+        if old.tolist() != new.tolist():
+            raise ValueError("resetSNP_column is not the same as resetSNP")
+        print("same result: True")
+
+        start = time.time()
+        load_bolt(path, compression=path.endswith(".gz"), sep="\t", resetID=True)
+        print(f"load_bolt(resetID=True) of the whole file: {time.time() - start:.2f}s")
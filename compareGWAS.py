@@ -4,9 +4,11 @@ import argparse
 import textwrap
 import pandas as pd
 import numpy as np
-import seaborn as sns
 import matplotlib.pyplot as plt
-import matplotlib.cm as cm
+from functools import reduce
+from matplotlib.colors import LogNorm
+
+from gwas_reader import read_gwas
 
 
 def getParser():
@@ -20,6 +22,8 @@ def getParser():
         Example:
         1.读入gwas meta数据，./compare.py --file _apob.regenie.gz regenie apob.bgen.stats.gz bolt --gzip
         2.指定标题：./compare.py --file _apob.regenie.gz regenie apob.bgen.stats.gz bolt --gzip -o regenie_vs_bolt_apob 
+        3.多个文件两两比较：./compare.py --file a.regenie.gz regenie b.regenie.gz regenie c.stats.gz bolt_lmm --labels a b c --gzip -o abc
+          所有文件按ID一次合并，每两个文件画一个子图（下三角网格）；所有点画成2D直方图（--bins），只有P值<--sig的点单独画出，颜色为x轴文件的A1FREQ
         ...
 
         """
@@ -41,6 +45,10 @@ def getParser():
     parser.add_argument("--gzip", dest="gzip", help="gzip file", action="store_true")
     parser.add_argument("--resetID", dest="reset", help="resetID", action="store_true")
     parser.add_argument("-s", dest="s",help="scatter dot size", default=4, type=float)
+    parser.add_argument("--labels", dest="labels", nargs="+", default=None, help="label of each file, default is the type of the files")
+    parser.add_argument("--bins", dest="bins", default=400, type=int, help="bins of each axis of the 2D histogram, default 400")
+    parser.add_argument("--sig", dest="sig", default=5e-8, type=float, help="points with p-value < sig on either axis are drawn one by one, default 5e-8")
+    parser.add_argument("--cache", dest="cache", nargs="?", const=True, default=None, metavar="DIR", help="save the parsed input as a columnar sidecar (.npcache) next to the input, or in DIR if given; later runs on the same unchanged file load the sidecar instead of parsing the text")
     return parser
 
 
@@ -52,24 +60,32 @@ def resetSNP(x, ID="SNP", pos="BP"):
     return ":".join(o)
 
 
-def load_bolt(boltPath, compression, sep, resetID=False, **kwargs):
-    if compression:
-        bolt = pd.read_csv(boltPath, compression="gzip", sep=sep)
-    else:
-        bolt = pd.read_csv(boltPath, sep=sep)
+def resetSNP_column(ID, pos):
+    """
+    resetSNP over the whole ID and pos columns instead of one row at a time: 1:100:A:G with pos 123 => 1:123:A:G
+    """
+    out = []
+    for snp, bp in zip(ID.tolist(), pos.astype(str).tolist()):
+        o = snp.split(":", 2)
+        o[1] = bp
+        out.append(":".join(o))
+    return pd.Series(out, index=ID.index, dtype=ID.dtype)
+
+
+def load_bolt(boltPath, compression, sep, resetID=False, cache=None, **kwargs):
+    usecols = ["SNP", "BP", "P_BOLT_LMM", "A1FREQ"] if resetID else ["SNP", "P_BOLT_LMM", "A1FREQ"]
+    bolt = read_gwas(boltPath, "bolt", usecols=usecols, cache=cache, compression="gzip" if compression else "infer")
     if resetID:
-        bolt["SNP"] = bolt.apply(resetSNP, axis=1)
+        bolt["SNP"] = resetSNP_column(bolt["SNP"], bolt["BP"])
 
     bolt["bolt_lmm"] = -np.log10(bolt["P_BOLT_LMM"])
     bolt.rename(columns={"SNP": "ID", "A1FREQ": "bolt_A1FREQ"}, inplace=True)
     return bolt[["ID", "bolt_lmm", "bolt_A1FREQ"]]
 
 
-def load_regenie(regeniePath, compression, sep, **kwargs):
-    if compression:
-        regenie = pd.read_csv(regeniePath, compression="gzip", sep=sep)
-    else:
-        regenie = pd.read_csv(regeniePath, sep=sep)
+def load_regenie(regeniePath, compression, sep, cache=None, **kwargs):
+    usecols = ["ID", "LOG10P", "A1FREQ"]
+    regenie = read_gwas(regeniePath, "regenie", usecols=usecols, cache=cache, compression="gzip" if compression else "infer")
     regenie = regenie[["ID", "LOG10P", "A1FREQ"]].rename(
         columns={"LOG10P": "regenie", "A1FREQ": "regenie_A1FREQ"}
     )  # "ID" is the SNP ID, "LOG10P" is the p-value, "A1FREQ" is the frequency of the effect allele
@@ -86,6 +102,69 @@ def load_gwas_meta(filePath, type, compression, sep, **kwargs):
         raise ValueError("type must be bolt_lmm or regenie")
 
 
+def join_inputs(outputList, labels=None):
+    """
+    Inner join of all loaded inputs on ID at once, each input is renamed to its label: ID label1 label1_A1FREQ label2 label2_A1FREQ ...
+
+    Labels default to the type column of each input (regenie, bolt_lmm), with _1, _2 ... if a type is used more than once.
+    """
+    if labels is None:
+        types = [df.columns[1] for df in outputList]
+        labels = [f"{t}_{types[:i + 1].count(t)}" if types.count(t) > 1 else t for i, t in enumerate(types)]
+    if len(labels) != len(outputList):
+        raise ValueError(f"{len(labels)} labels for {len(outputList)} files")
+    if len(outputList) < 2:
+        raise ValueError(f"at least 2 files to compare, got {len(outputList)}")
+
+    renamed = [df.set_axis(["ID", label, f"{label}_A1FREQ"], axis=1) for df, label in zip(outputList, labels)]
+    compare = reduce(lambda left, right: left.merge(right, on="ID"), renamed)
+    return compare, labels
+
+
+def plot_pair(ax, x, y, freq, bins=400, sig=5e-8, s=4):
+    """
+    Binned 2D histogram of all points (log color scale of the counts), the points over -log10(sig) on either axis are drawn one by one colored by freq.
+    """
+    x = x.to_numpy(dtype=np.float64)
+    y = y.to_numpy(dtype=np.float64)
+    freq = freq.to_numpy(dtype=np.float64)
+    finite = np.isfinite(x) & np.isfinite(y)
+    x, y, freq = x[finite], y[finite], freq[finite]
+    if len(x) == 0:
+        return None
+
+    lim = (min(x.min(), y.min()), max(x.max(), y.max()))
+    counts, xedges, yedges = np.histogram2d(x, y, bins=bins, range=[lim, lim])
+    ax.pcolormesh(xedges, yedges, np.ma.masked_equal(counts.T, 0), cmap="Greys", norm=LogNorm(), zorder=1, rasterized=True)
+
+    is_sig = (x > -np.log10(sig)) | (y > -np.log10(sig))
+    points = ax.scatter(x[is_sig], y[is_sig], c=freq[is_sig], s=s, cmap="viridis", vmin=0, vmax=1, zorder=3)
+    ax.plot(lim, lim, "--c", zorder=2)
+    return points
+
+
+def plot_grid(compare, labels, bins=400, sig=5e-8, s=4, xlabel=None, ylabel=None):
+    """
+    One panel for each pair of inputs, in the lower triangle of a (N-1) x (N-1) grid: x is the i-th input, y the j-th input (i < j).
+    """
+    n = len(labels) - 1
+    fig, axes = plt.subplots(n, n, figsize=(8 * n, 8 * n), squeeze=False)
+    points = None
+    for j in range(1, n + 1):
+        for i in range(n):
+            ax = axes[j - 1, i]
+            if i >= j:
+                ax.axis("off")
+                continue
+            pair_points = plot_pair(ax, compare[labels[i]], compare[labels[j]], compare[f"{labels[i]}_A1FREQ"], bins=bins, sig=sig, s=s)
+            points = pair_points if pair_points is not None else points
+            ax.set_xlabel(xlabel if xlabel and n == 1 else labels[i])
+            ax.set_ylabel(ylabel if ylabel and n == 1 else labels[j])
+    if points is not None:
+        fig.colorbar(points, ax=axes.ravel().tolist(), label="A1FREQ of x", shrink=0.6)
+    return fig
+
+
 if __name__ == "__main__":
     parser = getParser()
     args = parser.parse_args()
@@ -101,6 +180,8 @@ if __name__ == "__main__":
     num_files = len(files)
     if num_files % 2 != 0:
         parser.error("每个文件需要指定一个类型")
+    if num_files < 4:
+        parser.error("至少需要两个文件才能比较：--file a.regenie.gz regenie b.regenie.gz regenie")
 
     outputList = []
     for i in range(0, num_files, 2):
@@ -113,31 +194,14 @@ if __name__ == "__main__":
                 compression=gzip,
                 sep=sep,
                 resetID=resetID,
+                cache=args.cache,
             )
         )
         print(f"load {filePath} as {file_type}")
 
-    compare = outputList[0].merge(outputList[1], on="ID")
-
-    # columns should be ID file1 file1_A1FREQ file2 file2_A1FREQ....
-    axisList = [compare.columns[i] for i in range(1, len(compare.columns), 2)]
+    compare, labels = join_inputs(outputList, labels=args.labels)
     print(f"用于绘图的点有：{compare.shape[0]}")
-    # # plot
-    fig, ax = plt.subplots(1, 1, figsize=(10, 10))
-
-    sns.scatterplot(
-        data=compare,
-        x=f"{axisList[0]}",
-        y=f"{axisList[1]}",
-        hue=compare.columns[2],
-        s=s,
-        ax=ax,zorder=2
-    )
-    ax.plot(ax.get_xlim(), ax.get_ylim(), "--c", zorder=1)
 
-    if xlabel:
-        ax.set_xlabel(xlabel)
-    if ylabel:
-        ax.set_ylabel(ylabel)
+    fig = plot_grid(compare, labels, bins=args.bins, sig=args.sig, s=s, xlabel=xlabel, ylabel=ylabel)
     fig.savefig(f"{output}.png", dpi=400)
     fig.clf()
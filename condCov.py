@@ -5,30 +5,94 @@ import pandas as pd
 import os.path as osp
 import argparse
 import textwrap
+from multiprocessing import get_context
 
 
-def generateCovWithTagSNP(covPath, plink2EtractTagSNPGenoTypePath, outputRootDir):
+_COV_LINES = None
+_GENOTYPES = None
+
+
+def align_genotypes(cov, TagSNPs):
+    """
+    Rows of TagSNPs for each row of cov by FID IID, found once for all tag SNPs.
+
+    Returns:
+        tuple: (cov rows with a genotype, like cov.merge(TagSNPs, on=["FID", "IID"]); genotypes of these rows)
+    """
+    key = pd.MultiIndex.from_frame(TagSNPs[["FID", "IID"]])
+    if not key.is_unique:
+        raise ValueError("FID IID of the tagSNP file should be unique")
+    rows = key.get_indexer(pd.MultiIndex.from_frame(cov[["FID", "IID"]]))
+    keep = rows >= 0
+    return cov[keep].reset_index(drop=True), TagSNPs.iloc[rows[keep], 6:].reset_index(drop=True)
+
+
+def _write_cov(task):
+    """
+    The shared cov columns (formatted once) + one genotype column, no merge of the cov table
+    """
+    name, path = task
+    genotype = _GENOTYPES[name].to_csv(index=False, header=False, na_rep="NA", lineterminator="\n").split("\n")
+    header, lines = _COV_LINES
+    with open(path, "w") as f:
+        f.write(f"{header} {name}\n")
+        for line, value in zip(lines, genotype):
+            f.write(f"{line} {value}\n")
+    return name, path
+
+
+def generateCovWithTagSNP(covPath, plink2EtractTagSNPGenoTypePath, outputRootDir, threads=1):
+    global _COV_LINES, _GENOTYPES
     cov = pd.read_csv(covPath, sep="\s+")
     TagSNPs = pd.read_csv(plink2EtractTagSNPGenoTypePath, sep="\s+")
 
     TagSNPNum = TagSNPs.shape[1] - 6
     print(f"读入{TagSNPNum}个SNP")
     TagSNPName = TagSNPs.columns[6:].to_list()
-    supplement = []
-    for idx, currentTagSNPName in enumerate(TagSNPName):
-        subdata = TagSNPs[["FID", "IID", currentTagSNPName]]
-        covWithCurrentTagSNP = cov.merge(
-            subdata, left_on=["FID", "IID"], right_on=["FID", "IID"]
-        )
-        covWithCurrentTagSNPOutputPath = osp.join(outputRootDir, f"tagSNP_{idx}.cov")
-        covWithCurrentTagSNP.to_csv(covWithCurrentTagSNPOutputPath, index=False, sep=" ")
 
-        supplement.append([currentTagSNPName, covWithCurrentTagSNPOutputPath])
-        print(f"{currentTagSNPName}保存到{covWithCurrentTagSNPOutputPath}")
+    cov, _GENOTYPES = align_genotypes(cov, TagSNPs)
+    lines = cov.to_csv(index=False, sep=" ", na_rep="NA", lineterminator="\n").split("\n")
+    _COV_LINES = (lines[0], lines[1 : len(cov) + 1])
+
+    tasks = [(name, osp.join(outputRootDir, f"tagSNP_{idx}.cov")) for idx, name in enumerate(TagSNPName)]
+    supplement = []
+    if threads > 1 and len(tasks) > 1:
+        with get_context("fork").Pool(min(threads, len(tasks))) as pool:
+            for currentTagSNPName, covWithCurrentTagSNPOutputPath in pool.imap(_write_cov, tasks):
+                supplement.append([currentTagSNPName, covWithCurrentTagSNPOutputPath])
+                print(f"{currentTagSNPName}保存到{covWithCurrentTagSNPOutputPath}")
+    else:
+        for task in tasks:
+            currentTagSNPName, covWithCurrentTagSNPOutputPath = _write_cov(task)
+            supplement.append([currentTagSNPName, covWithCurrentTagSNPOutputPath])
+            print(f"{currentTagSNPName}保存到{covWithCurrentTagSNPOutputPath}")
 
     with open(osp.join(outputRootDir, "sup.log"), "w") as f:
         for i in supplement:
-            f.write(f"{i[0]}\t{i[1]}")
+            f.write(f"{i[0]}\t{i[1]}\n")
+
+
+def generateWideCov(covPath, plink2EtractTagSNPGenoTypePath, outputRootDir):
+    """
+    One cov file with all tag SNPs as columns tagSNP_{idx}, and cov_columns.tsv: tagSNP => its column => --covarColList of regenie
+    """
+    cov = pd.read_csv(covPath, sep="\s+")
+    TagSNPs = pd.read_csv(plink2EtractTagSNPGenoTypePath, sep="\s+")
+    TagSNPName = TagSNPs.columns[6:].to_list()
+    print(f"读入{len(TagSNPName)}个SNP")
+
+    cov, genotypes = align_genotypes(cov, TagSNPs)
+    columns = [f"tagSNP_{idx}" for idx in range(len(TagSNPName))]
+    genotypes.columns = columns
+    wideCovPath = osp.join(outputRootDir, "tagSNP.cov")
+    pd.concat([cov, genotypes], axis=1).to_csv(wideCovPath, index=False, sep=" ", na_rep="NA")
+    print(f"{len(TagSNPName)}个SNP保存到{wideCovPath}")
+
+    covarCols = ",".join(c for c in cov.columns if c not in ("FID", "IID"))
+    with open(osp.join(outputRootDir, "cov_columns.tsv"), "w") as f:
+        f.write("tagSNP\tcolumn\tcovarColList\n")
+        for name, column in zip(TagSNPName, columns):
+            f.write(f"{name}\t{column}\t{covarCols},{column}\n")
 
 
 def getParser():
@@ -76,6 +140,13 @@ def getParser():
         dest="output",
         help="output root dir",
     )
+    parser.add_argument("--threads", dest="threads", default=1, type=int, help="write the tagSNP_{idx}.cov files in this many processes, default 1")
+    parser.add_argument(
+        "--wide",
+        dest="wide",
+        action="store_true",
+        help="write one tagSNP.cov with all tagSNPs as columns tagSNP_{idx}, and cov_columns.tsv with the --covarColList of each tagSNP for regenie",
+    )
     return parser
 
 
@@ -87,4 +158,7 @@ if __name__ == "__main__":
     tagSNPPath = args.cond
     output = args.output
 
-    generateCovWithTagSNP(covPath, tagSNPPath, output)
+    if args.wide:
+        generateWideCov(covPath, tagSNPPath, output)
+    else:
+        generateCovWithTagSNP(covPath, tagSNPPath, output, args.threads)
@@ -5,7 +5,13 @@ import argparse
 import textwrap
 import numpy as np 
 import pandas as pd 
+import re
+import sys
 import warnings
+from multiprocessing import get_context
+
+from gwas_cache import read_cached
+
 warnings.filterwarnings("ignore")
 
 def getParser():
@@ -40,6 +46,10 @@ def getParser():
     parser.add_argument("--IDCol", dest="IDCol", default=3, required=False, help="ID column index", type=int)
     parser.add_argument("--PvalueCol", dest="PvalueCol", default=[], required=False, help="Pvalue column index will apply FDR at this col，并且请注意指定P值是LOG10P还是其他的；请按照这个规范 --PvalueCol 12 P", nargs="+",type=int)
     parser.add_argument("-P", dest="P",  required=False, help="传入的Pvalue列是LOG10P还是P，-P 表面是非LOG10P，默认是LOG10P", action="store_true")
+    parser.add_argument("--skip-intermediate", dest="skip_intermediate", action="store_true", help="不写出中间文件 .drop_consequence 和 .beforeFDR")
+    parser.add_argument("-t", "--threads", dest="threads", default=1, type=int, help="同时写出多个输出文件的进程数，default 1")
+    parser.add_argument("--chunksize", dest="chunksize", default=None, type=int, help="流式模式：每次读入的行数，文件读两遍，内存不随文件大小增加，输出与一次读入相同")
+    parser.add_argument("--cache", dest="cache", nargs="?", const=True, default=None, metavar="DIR", help="把解析后的输入保存为列式缓存(.npcache)，默认放在输入文件旁边，指定DIR则放在DIR中；之后对同一个未修改的文件直接读取缓存，不再解析文本")
 
     return parser
 
@@ -58,6 +68,133 @@ def exactInFilterList(string, filterList):
             return True
     return False
 
+def consequence_mask(consequence, filterList):
+    """
+    Vectorized inFilterList: True for the rows whose Consequence has none of filterList as a substring, NA is dropped.
+    """
+    if len(filterList) == 0:
+        return consequence.notna().to_numpy()
+    pattern = re.compile("|".join(re.escape(i) for i in filterList))
+    return (consequence.notna() & ~consequence.astype(str).str.contains(pattern)).to_numpy()
+
+
+def symbol_mask(symbol, SYMBOL):
+    """
+    Vectorized exactInFilterList
+    """
+    return symbol.astype(str).isin(SYMBOL).to_numpy()
+
+
+def pvalue_mask(df, PvalueColList, FDRCUTOFF, LOG10P=True):
+    """
+    All PvalueColList pass FDRCUTOFF: LOG10P > -log10(FDRCUTOFF) or P < FDRCUTOFF
+    """
+    if LOG10P:
+        return (df[PvalueColList] > -np.log10(FDRCUTOFF)).all(axis=1).to_numpy()
+    return (df[PvalueColList] < FDRCUTOFF).all(axis=1).to_numpy()
+
+
+_TABLE = None
+
+
+def _write_rows(task):
+    keep, path = task
+    _TABLE[keep].to_csv(path, sep="\t", index=False, na_rep="NA")
+    return path
+
+
+def write_tables(df, writes, threads=1):
+    """
+    Write df[keep] to path for each (keep, path) of writes, threads > 1 will write them at the same time in forked processes.
+    """
+    global _TABLE
+    _TABLE = df
+    if threads > 1 and len(writes) > 1:
+        with get_context("fork").Pool(min(threads, len(writes))) as pool:
+            for path in pool.imap_unordered(_write_rows, writes):
+                print(f"写出{path}")
+    else:
+        for task in writes:
+            print(f"写出{_write_rows(task)}")
+
+
+def merge_dtypes(dtypes):
+    """
+    dtype of a column over all chunks, the same as pandas would infer from the whole file:
+    int and float => float, any other mix (like str in one chunk and float in another) => str.
+    """
+    dtypes = set(dtypes)
+    if len(dtypes) == 1:
+        return dtypes.pop()
+    if all(pd.api.types.is_numeric_dtype(i) and not pd.api.types.is_bool_dtype(i) for i in dtypes):
+        return np.float64 if any(pd.api.types.is_float_dtype(i) for i in dtypes) else np.int64
+    return str
+
+
+def stream_filter(filePath, outFilePath, consequence, SYMBOL, IDCol, PvalueColList, LOG10P=True, chunksize=1000000, skip_intermediate=False):
+    """
+    Two-pass streaming version of the in-memory filter, the memory depends on chunksize and the number of distinct IDs, not the file.
+
+    Pass 1 applies the consequence and GENESYMBOL filters to each chunk, counts the distinct IDs left (exact, a set of the IDs)
+    and records the dtype of each column in each chunk; pass 2 reads the file again with the dtypes of the whole file, applies
+    the cutoff and appends each chunk to the outputs, so the outputs are the same as the in-memory path.
+    """
+    header = pd.read_csv(filePath, sep="\s+", nrows=0).columns
+    IDCol = header[IDCol-1]
+    PvalueColList = [header[i-1] for i in PvalueColList]
+
+    # pass 1: filter, count distinct IDs and find the dtypes
+    dtypes = {col: [] for col in header}
+    seen, has_na = set(), False
+    total, kept = 0, 0
+    for chunk in pd.read_csv(filePath, sep="\s+", chunksize=chunksize, dtype={IDCol: str}):
+        for col in header:
+            if col != IDCol:
+                dtypes[col].append(chunk[col].dtype)
+        keep = consequence_mask(chunk["Consequence"], consequence)
+        if len(SYMBOL) != 0:
+            keep = keep & symbol_mask(chunk["SYMBOL"], SYMBOL)
+        ids = chunk.loc[keep, IDCol]
+        has_na |= bool(ids.isna().any())
+        seen.update(ids.dropna().tolist())
+        total += chunk.shape[0]
+        kept += int(keep.sum())
+    dtypes = {col: merge_dtypes(i) for col, i in dtypes.items() if i}
+    variantsNum = len(seen) + has_na
+    del seen
+    print(f"原始有{total}行，过滤consequence和GENESYMBOL后有{kept}行")
+
+    if len(PvalueColList) != 0:
+        print(f"目前有{variantsNum}个变异")
+        FDRCUTOFF = 0.05/max(variantsNum, 1)  # no variant left (empty input): nothing to pass, keep the cutoff finite
+        print(f"FDRCUTOFF: {FDRCUTOFF}")
+    else:
+        print(f"不进行FDR过滤")
+
+    # pass 2: filter again and write
+    outputs = []
+    if not skip_intermediate:
+        outputs.append("drop_consequence")
+        if len(SYMBOL) != 0:
+            outputs.append("beforeFDR")
+    if len(PvalueColList) != 0:
+        outputs.append("FDR")
+    paths = {"drop_consequence": outFilePath+".drop_consequence", "beforeFDR": outFilePath+".beforeFDR", "FDR": outFilePath}
+    counts = {name: 0 for name in outputs}
+    for name in outputs:
+        # header first, the outputs of an input without rows are header only like the in-memory path
+        pd.DataFrame(columns=header).to_csv(paths[name], sep="\t", index=False)
+    for chunk in pd.read_csv(filePath, sep="\s+", chunksize=chunksize, dtype=dtypes):
+        masks = {"drop_consequence": consequence_mask(chunk["Consequence"], consequence)}
+        masks["beforeFDR"] = masks["drop_consequence"] & symbol_mask(chunk["SYMBOL"], SYMBOL) if len(SYMBOL) != 0 else masks["drop_consequence"]
+        if len(PvalueColList) != 0:
+            masks["FDR"] = masks["beforeFDR"] & pvalue_mask(chunk, PvalueColList, FDRCUTOFF, LOG10P)
+        for name in outputs:
+            chunk[masks[name]].to_csv(paths[name], sep="\t", index=False, na_rep="NA", mode="a", header=False)
+            counts[name] += int(masks[name].sum())
+    for name in outputs:
+        print(f"写出{paths[name]}：{counts[name]}行")
+
 
 if __name__ == "__main__":
     parser = getParser()
@@ -87,46 +224,46 @@ if __name__ == "__main__":
     print(f"是否是LOG10P：{LOG10P}")
 
 
-    vep = pd.read_csv(filePath, sep="\s+")
+    if args.chunksize:
+        print(f"去除这些consequence: {','.join(consequence)}")
+        stream_filter(filePath, outFilePath, consequence, SYMBOL, IDCol, PvalueColList, LOG10P, chunksize=args.chunksize, skip_intermediate=args.skip_intermediate)
+        sys.exit(0)
+
+    vep = read_cached(filePath, cache=args.cache, sep="\s+")
     IDCol = vep.columns[IDCol-1]
     PvalueColList = [vep.columns[i-1] for i in PvalueColList]
 
-    keep_consequence = [i for i in vep["Consequence"].unique() if not inFilterList(i,consequence)]
-
     # step1 filter consequence, must have this output: outFilePath+".drop_consequence"
     print(f"去除这些consequence: {','.join(consequence)}")
     print(f"原始有{vep.shape[0]}行")
-    vep = vep[vep["Consequence"].apply(lambda x: str(x) in keep_consequence)] # turn NA => "NA"
-    print(f"过滤后有{vep.shape[0]}行")
-    # step2 保留GENESYMBOL对应的数据
-    vep.to_csv(outFilePath+".drop_consequence", sep="\t", index=False, na_rep="NA")
+    keep = consequence_mask(vep["Consequence"], consequence)
+    print(f"过滤后有{keep.sum()}行")
+    writes = [] if args.skip_intermediate else [(keep, outFilePath+".drop_consequence")]
 
     # step2 optional, if have output name is outFilePath+".beforeFDR"
     if len(SYMBOL) !=0:
-        vep = vep[vep["SYMBOL"].apply(lambda x : exactInFilterList(str(x), SYMBOL))]
-        print(f"保留GENESYMBOL：{SYMBOL}后还有{vep.shape[0]}行")
+        keep = keep & symbol_mask(vep["SYMBOL"], SYMBOL)
+        print(f"保留GENESYMBOL：{SYMBOL}后还有{keep.sum()}行")
         # FDR 之前额外保存一步
-        vep.to_csv(outFilePath+".beforeFDR", sep="\t", index=False, na_rep="NA")
+        if not args.skip_intermediate:
+            writes.append((keep, outFilePath+".beforeFDR"))
     else:
         print(f"不过滤GENESYMBOL")
 
     # step3 多重矫正, optional, if have output name is outFilePath
     if len(PvalueColList) != 0:
 
-        variantsNum=len(vep[IDCol].unique())
+        variantsNum=len(vep.loc[keep, IDCol].unique())
         print(f"目前有{variantsNum}个变异")
-        FDRCUTOFF = 0.05/variantsNum
+        FDRCUTOFF = 0.05/max(variantsNum, 1)  # no variant left (empty input): nothing to pass, keep the cutoff finite
         print(f"FDRCUTOFF: {FDRCUTOFF}")
-        print(f"过滤前有{vep.shape[0]}行")
+        print(f"过滤前有{keep.sum()}行")
 
         # TODO：保存所有的变异，但是给他们加上一列表示是否通过了FDR
-        if LOG10P:# LOG10P > FDRCUTOFF
-            FDRCUTOFF = -np.log10(FDRCUTOFF)
-            vep=vep[(vep[PvalueColList] > FDRCUTOFF).all(axis=1)]
-        else:# Pvalue < FDRCUTOFF; 
-            vep=vep[(vep[PvalueColList] < FDRCUTOFF).all(axis=1)]
-        print(f"过滤后有{vep.shape[0]}行")
-        vep.to_csv(outFilePath, sep="\t", index=False, na_rep="NA")
+        keep = keep & pvalue_mask(vep, PvalueColList, FDRCUTOFF, LOG10P)
+        print(f"过滤后有{keep.sum()}行")
+        writes.append((keep, outFilePath))
     else:
         print(f"不进行FDR过滤")
 
+    write_tables(vep, writes, threads=args.threads)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Description: chromosome name normalization shared by resetID.py, snpID2bed.py and pheweb_format.py
+@Author      :Tingfeng Xu
+@version      :1.0
+
+Modes:
+    chr      chr-prefixed: 1 => chr1, 23/X => chrX, 24/Y => chrY, 25/XY => chrXY, 26/MT => chrMT;
+             labels already with chr are kept as they are (chr1 => chr1, chr23 => chr23)
+    nochr    bare: only remove the chr prefix, chr1 => 1, 23 => 23, X => X
+    numeric  plink numeric code: chr1 => 1, X => 23, Y => 24, XY => 25, MT/M => 26
+
+Labels not known by the mode (contigs like GL000192.1) are returned unchanged.
+Usage:
+    from format_chr import getChromTable
+    table = getChromTable("chr")
+    table["23"]  # chrX, one dict hit per line, unseen labels are computed once and cached
+"""
+
+CHR_MODES = ("chr", "nochr", "numeric")
+
+SEX_CHR = {"23": "X", "24": "Y", "25": "XY", "26": "MT"}
+SEX_CODE = {"X": "23", "Y": "24", "XY": "25", "MT": "26", "M": "26"}
+
+
+def _formatChr(x, mode="chr"):
+    if mode == "nochr":
+        return x.replace("chr", "")
+
+    if mode == "chr" and x.startswith("chr"):
+        return x
+    bare = x[3:] if x.startswith("chr") else x
+    if bare.isdigit():
+        code = str(int(bare))
+        if mode == "numeric":
+            return code
+        if int(code) < 23:
+            return "chr" + code
+        if code in SEX_CHR:
+            return "chr" + SEX_CHR[code]
+        return x
+    if bare in SEX_CODE:
+        return SEX_CODE[bare] if mode == "numeric" else "chr" + bare
+    return x
+
+
+class ChromTable(dict):
+    """
+    Lookup table of chromosome label => normalized label for one mode.
+
+    Common labels are precomputed and any other label is computed once by __missing__ and cached.
+    """
+
+    def __init__(self, mode="chr"):
+        if mode not in CHR_MODES:
+            raise ValueError(f"mode should be one of {CHR_MODES}, got {mode}")
+        super().__init__()
+        self.mode = mode
+        for i in range(1, 27):
+            for x in (str(i), f"chr{i}"):
+                self[x]
+        for x in ("X", "Y", "XY", "MT", "M"):
+            self[x]
+            self[f"chr{x}"]
+
+    def __missing__(self, x):
+        value = _formatChr(x, self.mode)
+        self[x] = value
+        return value
+
+
+_TABLES = {}
+
+
+def getChromTable(mode="chr"):
+    """
+    Shared ChromTable of mode, so the cache is built once per process.
+    """
+    if mode not in _TABLES:
+        _TABLES[mode] = ChromTable(mode)
+    return _TABLES[mode]
+
+
+def formatChr(x, nochr=False):
+    """
+    Same call as the old formatChr of each script: nochr=True => nochr mode, else chr mode.
+    """
+    return getChromTable("nochr" if nochr else "chr")[x]
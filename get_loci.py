@@ -12,6 +12,11 @@ import warnings
 import textwrap
 from signal import SIG_DFL, SIGPIPE, signal
 import os.path as osp
+import gzip
+from io import StringIO
+from multiprocessing import Pool, shared_memory
+
+from gwas_reader import read_gwas, schema_dtypes, sniff_format, sort_chromosomes
 DEFAULT_NA = "NA"
 
 warnings.filterwarnings("ignore")
@@ -58,6 +63,255 @@ def get_loci(
             ]
 
 
+def _sort_hits(pos, pval):
+    """
+    Sort the hits of one chromosome once: p-value order, sorted positions and the rank of each hit in them.
+    """
+    by_pval = np.argsort(pval, kind="stable")
+    by_pos = np.argsort(pos, kind="stable")
+    rank = np.empty(len(pos), dtype=np.int64)
+    rank[by_pos] = np.arange(len(pos))  # index of each hit in sorted_pos
+    return by_pval, pos[by_pos], rank
+
+
+def _clump_sorted(pos, by_pval, sorted_pos, rank, min_peak_dist):
+    alive = np.ones(len(sorted_pos), dtype=bool)
+    peaks = []
+    for idx in by_pval:
+        if not alive[rank[idx]]:
+            continue
+        peaks.append(idx)
+        lo = np.searchsorted(sorted_pos, pos[idx] - min_peak_dist, side="left")
+        hi = np.searchsorted(sorted_pos, pos[idx] + min_peak_dist, side="right")
+        alive[lo:hi] = False
+    return np.asarray(peaks, dtype=np.int64)
+
+
+def clump_chrom(pos, pval, min_peak_dist=2e6):
+    """
+    Greedy peak clumping of the hits on one chromosome.
+
+    Args:
+        pos (np.ndarray): positions of the hits.
+        pval (np.ndarray): p-values of the hits, same length as pos.
+        min_peak_dist (float): hits within this distance (in bp) of a peak are dropped.
+
+    Returns:
+        np.ndarray: indices into pos/pval of the peaks, in the order they were picked.
+
+    Notes:
+        - Hits are visited once in ascending p-value order (stable, so ties keep input order like min()).
+        - Positions are kept in a sorted array and the +/- min_peak_dist window is located by searchsorted.
+    """
+    pos = np.asarray(pos)
+    by_pval, sorted_pos, rank = _sort_hits(pos, np.asarray(pval))
+    return _clump_sorted(pos, by_pval, sorted_pos, rank, min_peak_dist)
+
+
+def clump_chrom_sweep(pos, pval, min_peak_dists, min_pvals):
+    """
+    Clump the hits of one chromosome for every (min_pval, min_peak_dist) combination with a single sort.
+
+    The hits under a threshold are a prefix of the p-value order, and hits above it are never visited,
+    so the window knock-out on the shared sorted positions gives the same peaks as clump_chrom on the subset.
+
+    Yields:
+        tuple: (min_pval, min_peak_dist, indices into pos/pval of the peaks)
+    """
+    pos = np.asarray(pos)
+    pval = np.asarray(pval)
+    by_pval, sorted_pos, rank = _sort_hits(pos, pval)
+    sorted_pval = pval[by_pval]
+    for min_pval in min_pvals:
+        n = np.searchsorted(sorted_pval, min_pval, side="left")  # hits with pval < min_pval
+        for min_peak_dist in min_peak_dists:
+            yield min_pval, min_peak_dist, _clump_sorted(pos, by_pval[:n], sorted_pos, rank, min_peak_dist)
+
+
+def get_loci_vectorized(
+    df,
+    pval_col="pval",
+    pos_col="pos",
+    chrom_col="chrom",
+    min_peak_dist=2e6,
+    min_pval=1e-6,
+):
+    """
+    NumPy version of get_loci, works on the DataFrame directly and returns the peak rows.
+
+    Gives the same peak set as get_loci, which is kept as the reference (--engine reference).
+    """
+    hits = df[df[pval_col] < min_pval]
+    chrom = hits[chrom_col].to_numpy()
+    pos = hits[pos_col].to_numpy()
+    pval = hits[pval_col].to_numpy()
+
+    peaks = []
+    for c in pd.unique(chrom):
+        idx = np.flatnonzero(chrom == c)
+        peaks.append(idx[clump_chrom(pos[idx], pval[idx], min_peak_dist)])
+    peaks = np.concatenate(peaks) if peaks else np.array([], dtype=np.int64)
+    return hits.iloc[peaks]
+
+
+def get_loci_sweep(
+    df,
+    pval_col="pval",
+    pos_col="pos",
+    chrom_col="chrom",
+    min_peak_dists=(2e6,),
+    min_pvals=(1e-6,),
+):
+    """
+    Find the peaks for every combination of min_pvals x min_peak_dists from one sort of each chromosome.
+
+    Returns:
+        pd.DataFrame: long table of the peak rows, tagged by the min_pval and min_peak_dist columns.
+    """
+    hits = df[df[pval_col] < max(min_pvals)]
+    chrom = hits[chrom_col].to_numpy()
+    pos = hits[pos_col].to_numpy()
+    pval = hits[pval_col].to_numpy()
+
+    peaks = {}
+    for c in pd.unique(chrom):
+        idx = np.flatnonzero(chrom == c)
+        for min_pval, min_peak_dist, chrom_peaks in clump_chrom_sweep(pos[idx], pval[idx], min_peak_dists, min_pvals):
+            peaks.setdefault((min_pval, min_peak_dist), []).append(idx[chrom_peaks])
+
+    res = []
+    for min_pval in min_pvals:
+        for min_peak_dist in min_peak_dists:
+            loci = hits.iloc[np.concatenate(peaks.get((min_pval, min_peak_dist), [np.array([], dtype=np.int64)]))].copy()
+            loci["min_pval"] = min_pval
+            loci["min_peak_dist"] = min_peak_dist
+            res.append(loci)
+    return pd.concat(res, ignore_index=True)
+
+
+def _clump_shared(task):
+    """
+    Worker of get_loci_parallel: attach the shared pos/pval buffers and clump rows [start, end).
+    """
+    pos_name, pval_name, n, pos_dtype, start, end, min_peak_dist = task
+    pos_shm = shared_memory.SharedMemory(name=pos_name)
+    pval_shm = shared_memory.SharedMemory(name=pval_name)
+    try:
+        pos = np.ndarray((n,), dtype=pos_dtype, buffer=pos_shm.buf)
+        pval = np.ndarray((n,), dtype=np.float64, buffer=pval_shm.buf)
+        peaks = start + clump_chrom(pos[start:end], pval[start:end], min_peak_dist)
+        del pos, pval  # release the views before closing the buffers
+    finally:
+        pos_shm.close()
+        pval_shm.close()
+    return peaks
+
+
+def get_loci_parallel(
+    df,
+    pval_col="pval",
+    pos_col="pos",
+    chrom_col="chrom",
+    min_peak_dist=2e6,
+    min_pval=1e-6,
+    threads=2,
+):
+    """
+    Multi-process version of get_loci_vectorized, one task per chromosome.
+
+    The hits are grouped by chromosome and their pos/pval columns are copied once into shared memory,
+    so each worker only receives the buffer names and its [start, end) slice instead of pickled rows.
+    """
+    hits = df[df[pval_col] < min_pval]
+    codes, _ = pd.factorize(hits[chrom_col])
+    order = np.argsort(codes, kind="stable")
+    order = order[codes[order] >= 0]  # drop hits without chromosome
+    sorted_codes = codes[order]
+    n = len(order)
+    if n == 0:
+        return hits.iloc[[]]
+
+    pos = hits[pos_col].to_numpy()[order]
+    pval = hits[pval_col].to_numpy(dtype=np.float64)[order]
+    pos_shm = shared_memory.SharedMemory(create=True, size=pos.nbytes)
+    pval_shm = shared_memory.SharedMemory(create=True, size=pval.nbytes)
+    try:
+        np.ndarray(pos.shape, dtype=pos.dtype, buffer=pos_shm.buf)[:] = pos
+        np.ndarray(pval.shape, dtype=np.float64, buffer=pval_shm.buf)[:] = pval
+
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        ends = np.r_[starts[1:], n]
+        tasks = [
+            (pos_shm.name, pval_shm.name, n, pos.dtype, start, end, min_peak_dist)
+            for start, end in sorted(zip(starts, ends), key=lambda x: x[0] - x[1])  # biggest chromosome first
+        ]
+        with Pool(min(threads, len(tasks))) as p:
+            peaks = np.concatenate(p.map(_clump_shared, tasks))
+    finally:
+        pos_shm.close()
+        pos_shm.unlink()
+        pval_shm.close()
+        pval_shm.unlink()
+
+    return hits.iloc[np.sort(order[peaks])]
+
+
+def load_hits_streaming(
+    input_file,
+    chrom_col,
+    pos_col,
+    pval_col,
+    min_pval=1e-6,
+    is_log10p=False,
+    chunksize=1000000,
+    compression=None,
+):
+    """
+    Load only the rows under min_pval, with bounded memory.
+
+    The first pass streams the file in chunks and parses only chrom/pos/pval to find the line numbers of the hits;
+    the second pass reads the raw lines again and keeps the full text of those lines only. So the memory depends on
+    the number of hits, not the size of the file. Blank lines are counted as rows in both passes (skip_blank_lines=False),
+    and the hit lines are parsed with the dtypes of read_gwas, so the output is the same as reading the whole file.
+
+    Returns:
+        pd.DataFrame: full rows of the hits, with the same columns as the input file.
+    """
+    hit_rows = []
+    for chunk in pd.read_csv(
+        input_file,
+        sep="\s+",
+        header=0,
+        usecols=[chrom_col, pos_col, pval_col],
+        compression=compression,
+        chunksize=chunksize,
+        skip_blank_lines=False,
+    ):
+        pval = chunk[pval_col]
+        if is_log10p:
+            pval = 10 ** -pval
+        hit_rows.append(chunk.index.to_numpy()[(pval < min_pval).to_numpy()])
+    hit_rows = np.concatenate(hit_rows) if hit_rows else np.array([], dtype=np.int64)
+
+    lines = []
+    opener = gzip.open if compression == "gzip" else open
+    with opener(input_file, "rt") as f:
+        lines.append(f.readline())  # header
+        next_hit = 0
+        for row, line in enumerate(f):
+            if next_hit == len(hit_rows):
+                break
+            if row == hit_rows[next_hit]:
+                lines.append(line)
+                next_hit += 1
+
+    format = sniff_format(lines[0])
+    if format is None:
+        return pd.read_csv(StringIO("".join(lines)), sep="\s+", header=0)
+    sep, dtype, chrom = schema_dtypes(lines[0], format, float_dtype=np.float64)
+    return sort_chromosomes(pd.read_csv(StringIO("".join(lines)), sep=sep, header=0, dtype=dtype, engine="c"), chrom)
+
+
 def header_mapper(string, header_col):
     """
     Map a header string or index to a column index.
@@ -105,6 +359,12 @@ def getParser():
         2. If the pval is -log10(pval), please use --log10p.
         3. The output will be printed to stdout, so use > to redirect it to a file; or use -o to specify the output file
         4. The delimiter of input file is tab by default, use -d to specify it.
+        5. Peaks are found by the numpy engine by default; --engine reference will use the original pure python get_loci, which gives the same peaks but is much slower.
+        6. -t/--threads > 1 will clump each chromosome in its own worker process (numpy engine only).
+        7. For very large files use --chunksize 1000000, the file is streamed and only rows under --min-pval are kept in memory.
+        8. --min-pval 5e-8 1e-6 1e-5 --min-peak-dist 5e5 1e6 2e6 will find the peaks of all combinations from one read of the file,
+           the output is a long table with two more columns min_pval and min_peak_dist; it runs in one process on the numpy engine, so -t and --engine reference can't be used with it.
+        9. --cache will save the parsed input as a sidecar at the first run, later runs on the same file load it in seconds instead of parsing the text again.
 
         """
         ),
@@ -130,16 +390,18 @@ def getParser():
     )
     parser.add_argument(
         "--min-pval",
-        help="minimum p-value to consider",
+        help="minimum p-value to consider; multiple values will run all of them in one pass",
         type=float,
-        default=1e-6,
+        default=[1e-6],
+        nargs="+",
         dest="min_pval",
     )
     parser.add_argument(
         "--min-peak-dist",
-        help="minimum distance between peaks (in bp)",
+        help="minimum distance between peaks (in bp); multiple values will run all of them in one pass",
         type=float,
-        default=2e6,
+        default=[2e6],
+        nargs="+",
         dest="min_peak_dist",
     )
     parser.add_argument(
@@ -152,7 +414,30 @@ def getParser():
     parser.add_argument(
         "-o", "--output", help="output file", default=None, dest="output"
     )
-    parser.add_argument("-t", "--threads", help="threads", default=1, dest="threads",type=int)
+    parser.add_argument("-t", "--threads", help="threads, >1 will find peaks of each chromosome in parallel", default=1, dest="threads",type=int)
+    parser.add_argument(
+        "--chunksize",
+        help="stream the input in chunks of this many rows and only keep the hits under --min-pval in memory",
+        type=int,
+        default=None,
+        dest="chunksize",
+    )
+    parser.add_argument(
+        "--engine",
+        help="peak finding engine, numpy is the default; reference is the original pure python version",
+        choices=["numpy", "reference"],
+        default="numpy",
+        dest="engine",
+    )
+    parser.add_argument(
+        "--cache",
+        nargs="?",
+        const=True,
+        default=None,
+        metavar="DIR",
+        dest="cache",
+        help="save the parsed input as a columnar sidecar (.npcache) next to the input, or in DIR if given; later runs on the same unchanged file load the sidecar instead of parsing the text",
+    )
 
     return parser
 
@@ -170,12 +455,31 @@ if __name__ == "__main__":
         sys.exit(1)
     threads = args.threads
     is_log10p = args.log10p
-    min_pval = args.min_pval
-    min_peak_dist = args.min_peak_dist
+    min_pval_list = sorted(set(args.min_pval))
+    min_peak_dist_list = sorted(set(args.min_peak_dist))
+    is_sweep = len(min_pval_list) > 1 or len(min_peak_dist_list) > 1
+    if is_sweep and (threads > 1 or args.engine == "reference"):
+        parser.error("several --min-pval or --min-peak-dist run on the numpy engine in one process, remove -t/--threads and --engine reference")
+    min_pval = max(min_pval_list)
+    min_peak_dist = min_peak_dist_list[0]
 
     input_file = args.input
     compression = "gzip" if input_file.endswith(".gz") else None
-    file = pd.read_csv(input_file, sep="\s+", header=0, compression=compression)
+    if args.chunksize:
+        header = pd.read_csv(input_file, sep="\s+", header=0, compression=compression, nrows=0).columns.tolist()
+        chr, pos, pval = [header[header_mapper(col, header) - 1] for col in args.cols]
+        file = load_hits_streaming(
+            input_file,
+            chrom_col=chr,
+            pos_col=pos,
+            pval_col=pval,
+            min_pval=min_pval,
+            is_log10p=is_log10p,
+            chunksize=args.chunksize,
+            compression=compression,
+        )
+    else:
+        file = read_gwas(input_file, cache=args.cache, compression=compression, float_dtype=np.float64)  # peaks are written out as they are
         
     output_file = args.output if args.output else sys.stdout
 
@@ -185,27 +489,50 @@ if __name__ == "__main__":
     # print(chr, pos, pval)
     if is_log10p:
         file[pval] = 10 ** -file[pval]
-    if threads ==1:
-        locis = get_loci(
-            file.to_dict(orient="records"),
+    if is_sweep:
+        locis = get_loci_sweep(
+            file,
+            pval_col=pval,
+            pos_col=pos,
+            chrom_col=chr,
+            min_peak_dists=min_peak_dist_list,
+            min_pvals=min_pval_list,
+        )
+    elif args.engine == "reference":
+        # peaks are found on the records, the output rows are taken from the frame so both engines write the same text
+        records = file.to_dict(orient="records")
+        for row, record in enumerate(records):
+            record["_row"] = row
+        peaks = get_loci(
+            records,
             pval_col=pval,
             pos_col=pos,
             chrom_col=chr,
             min_peak_dist=min_peak_dist,
             min_pval=min_pval,
-        ) 
+        )
+        locis = file.iloc[[peak["_row"] for peak in peaks]]
     elif threads > 1:
-        raise NotImplementedError("Not implemented yet.")
-        # from multiprocessing import Pool
-        # from functools import partial
-        
-        # with Pool(threads) as p:             
-        #     file_gb_chr = [chr_df[1].to_dict(orient="records") for chr_df in file.groupby(chr)]
-        #     get_loci_multi = partial(get_loci, pval_col=pval, pos_col=pos, chrom_col=chr, min_peak_dist=min_peak_dist, min_pval=min_pval)
-            
-        #     locis = p.map(get_loci, file_gb_chr)
+        locis = get_loci_parallel(
+            file,
+            pval_col=pval,
+            pos_col=pos,
+            chrom_col=chr,
+            min_peak_dist=min_peak_dist,
+            min_pval=min_pval,
+            threads=threads,
+        )
+    else:
+        locis = get_loci_vectorized(
+            file,
+            pval_col=pval,
+            pos_col=pos,
+            chrom_col=chr,
+            min_peak_dist=min_peak_dist,
+            min_pval=min_pval,
+        )
     locis_df = pd.DataFrame(locis)
-    locis_df.sort_values(by=[chr, pos], inplace=True)
+    locis_df.sort_values(by=["min_pval", "min_peak_dist", chr, pos] if is_sweep else [chr, pos], inplace=True)
     if is_log10p:
         locis_df[pval] = -np.log10(locis_df[pval])
 
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Description: columnar on-disk cache of parsed tables, shared by get_loci.py, compareGWAS.py, mergeGWASMulitPheno.py, filterRegenie.py and merge.py
+@Author      :Tingfeng Xu
+@version      :1.0
+
+The first time a file is read with a cache, the parsed DataFrame is saved as a sidecar directory of one .npy file per column:
+    numeric columns   <i>.npy, loaded with copy-on-write mmap: pages are read on first use, writes stay in memory
+    string columns    <i>.codes.npy (int32, -1 is NA) + <i>.txt (the unique values or the categories, one per line)
+    meta.json         size and mtime of the file, read options, columns and dtypes
+Later reads only load the requested columns (usecols) from the sidecar, and the sidecar is rebuilt when the size or mtime of the file changes.
+
+Usage:
+    from gwas_cache import read_cached
+    df = read_cached("apob.regenie.gz", cache=True, usecols=["ID", "LOG10P"])  # sidecar next to the file
+    df = read_cached("apob.regenie.gz", cache="/tmp/gwas_cache")  # sidecars in /tmp/gwas_cache
+"""
+import hashlib
+import json
+import os
+import os.path as osp
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 1
+
+
+def _cache_path(path, cache, sep, header, dtype, kwargs=None):
+    """
+    Sidecar of path with these read options (kwargs are the other pd.read_csv options); cache=True puts it next to the file, a str puts it in that directory.
+    """
+    path = osp.abspath(path)
+    options = [[k, str(v)] for k, v in sorted((kwargs or {}).items())]
+    key = json.dumps([CACHE_VERSION, path, sep, header, str(dtype), options])
+    key = hashlib.md5(key.encode()).hexdigest()[:12]
+    cache_dir = osp.dirname(path) if cache is True else cache
+    return osp.join(cache_dir, f".{osp.basename(path)}.{key}.npcache")
+
+
+def _load_meta(cache_path, stat):
+    try:
+        with open(osp.join(cache_path, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta["size"] != stat.st_size or meta["mtime_ns"] != stat.st_mtime_ns:
+        return None
+    return meta
+
+
+def write_cache(df, cache_path, stat, sep, header, dtype):
+    """
+    Save df as a sidecar directory at cache_path, written to a temporary directory first and then renamed.
+    """
+    parent = osp.dirname(cache_path)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix=".tmp")
+    try:
+        os.chmod(tmp, 0o755)
+        dtypes = []
+        for i, col in enumerate(df.columns):
+            values = df[col]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+                kind = "category"
+            elif not (pd.api.types.is_numeric_dtype(values.dtype) or pd.api.types.is_bool_dtype(values.dtype)):
+                codes, uniques = pd.factorize(values)
+                kind = "str"
+            else:
+                kind = None
+            if kind:
+                np.save(osp.join(tmp, f"{i}.codes.npy"), codes.astype(np.int32))
+                with open(osp.join(tmp, f"{i}.txt"), "w") as f:
+                    f.write("\n".join(map(str, uniques)))
+                dtypes.append(kind)
+            else:
+                np.save(osp.join(tmp, f"{i}.npy"), values.to_numpy())
+                dtypes.append(str(values.dtype))
+        meta = {
+            "version": CACHE_VERSION,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sep": sep,
+            "header": header,
+            "dtype": str(dtype),
+            "columns": df.columns.tolist(),
+            "dtypes": dtypes,
+            "nrows": len(df),
+        }
+        with open(osp.join(tmp, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        if osp.exists(cache_path):
+            shutil.rmtree(cache_path, ignore_errors=True)
+        os.rename(tmp, cache_path)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def read_cache(cache_path, meta, usecols=None):
+    """
+    Load the columns usecols (column names, all columns if None) of a sidecar, in the order of the file like pd.read_csv.
+    """
+    columns = meta["columns"]
+    if usecols is None:
+        idx = range(len(columns))
+    else:
+        missing = [c for c in usecols if c not in columns]
+        if missing:
+            raise ValueError(f"Usecols do not match columns, columns expected but not found: {missing}")
+        idx = [i for i, c in enumerate(columns) if c in usecols]
+
+    data = {}
+    for i in idx:
+        if meta["dtypes"][i] in ("str", "category"):
+            codes = np.load(osp.join(cache_path, f"{i}.codes.npy"), mmap_mode="r")
+            with open(osp.join(cache_path, f"{i}.txt")) as f:
+                uniques = f.read().split("\n")
+            if meta["dtypes"][i] == "category":
+                data[columns[i]] = pd.Categorical.from_codes(codes, uniques if len(uniques) > 1 or uniques[0] else [])
+            else:
+                uniques = np.array(uniques + [np.nan], dtype=object)
+                data[columns[i]] = uniques[codes]  # -1 => the last one, NaN
+        else:
+            data[columns[i]] = np.load(osp.join(cache_path, f"{i}.npy"), mmap_mode="c")
+    return pd.DataFrame(data, columns=[columns[i] for i in idx], copy=False)  # keep the memmaps, the default copies them
+
+
+def read_cached(path, cache=None, usecols=None, sep=r"\s+", header=0, dtype=None, **kwargs):
+    """
+    pd.read_csv(path, sep=sep, header=header, usecols=usecols, dtype=dtype, **kwargs) with a columnar sidecar.
+
+    Args:
+        cache: None/False means no cache, just pd.read_csv; True puts the sidecar next to the file; a str is the directory of the sidecars.
+        kwargs: other pd.read_csv options like compression, they are part of the sidecar key: other options make another sidecar.
+
+    Returns:
+        pd.DataFrame: the same as pd.read_csv.
+    """
+    if not cache or path is None or path == "-":
+        return pd.read_csv(path if path not in (None, "-") else sys.stdin, sep=sep, header=header, usecols=usecols, dtype=dtype, **kwargs)
+
+    stat = os.stat(path)
+    cache_path = _cache_path(path, cache, sep, header, dtype, kwargs)
+    meta = _load_meta(cache_path, stat)
+    if meta is not None:
+        return read_cache(cache_path, meta, usecols)
+
+    df = pd.read_csv(path, sep=sep, header=header, dtype=dtype, **kwargs)
+    try:
+        write_cache(df, cache_path, stat, sep, header, dtype)
+    except OSError as e:
+        sys.stderr.write(f"can not write cache {cache_path}: {e}\n")
+    if usecols is not None:
+        df = df[[c for c in df.columns if c in usecols]]
+    return df
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Description: typed reader of regenie and BOLT-LMM outputs, used by compareGWAS.py and get_loci.py
+@Author      :Tingfeng Xu
+@version      :1.0
+
+The two formats have fixed columns, so they are parsed by the C engine with a single character delimiter and fixed dtypes
+instead of sep="\\s+" with type inference:
+    chromosome          category, ordered as 1 < 2 < ... < 22 < X < Y < XY < MT
+    alleles, TEST       category, most of them are A/C/G/T
+    position, N         int32
+    BETA, SE, A1FREQ..  float32
+    LOG10P, P           float64, float32 would lose the very small p-values (P_BOLT_LMM 1e-300 => 0)
+Columns not in the schema (like BETA.Y1 of multi-phenotype regenie outputs) are left to pandas.
+
+Usage:
+    from gwas_reader import read_gwas
+    df = read_gwas("apob.regenie.gz", "regenie", usecols=["ID", "LOG10P", "A1FREQ"])
+    df = read_gwas("apob.bgen.stats.gz")  # format from the header, None if it is not regenie or BOLT-LMM
+"""
+import gzip
+import os
+import sys
+import time
+
+import numpy as np
+
+from gwas_cache import read_cached
+from merge_join import sort_key
+
+REGENIE_DTYPES = {
+    "CHROM": "category",
+    "GENPOS": np.int32,
+    "ID": str,
+    "ALLELE0": "category",
+    "ALLELE1": "category",
+    "A1FREQ": np.float32,
+    "A1FREQ_CASES": np.float32,
+    "A1FREQ_CONTROLS": np.float32,
+    "INFO": np.float32,
+    "N": np.int32,
+    "TEST": "category",
+    "BETA": np.float32,
+    "SE": np.float32,
+    "CHISQ": np.float32,
+    "LOG10P": np.float64,
+    "EXTRA": "category",
+}
+
+BOLT_DTYPES = {
+    "SNP": str,
+    "CHR": "category",
+    "BP": np.int32,
+    "GENPOS": np.float32,
+    "ALLELE1": "category",
+    "ALLELE0": "category",
+    "A1FREQ": np.float32,
+    "F_MISS": np.float32,
+    "BETA": np.float32,
+    "SE": np.float32,
+    "P_LINREG": np.float64,
+    "CHISQ_BOLT_LMM_INF": np.float32,
+    "P_BOLT_LMM_INF": np.float64,
+    "CHISQ_BOLT_LMM": np.float32,
+    "P_BOLT_LMM": np.float64,
+}
+
+SCHEMAS = {  # first columns of the header, chromosome column, dtypes
+    "regenie": (("CHROM", "GENPOS", "ID"), "CHROM", REGENIE_DTYPES),
+    "bolt": (("SNP", "CHR", "BP"), "CHR", BOLT_DTYPES),
+}
+
+
+def read_header(path, compression="infer"):
+    if compression == "gzip" or (compression == "infer" and path.endswith(".gz")):
+        with gzip.open(path, "rt") as f:
+            return f.readline()
+    with open(path) as f:
+        return f.readline()
+
+
+def sniff_format(header):
+    """
+    Returns:
+        str: regenie, bolt or None, by the first columns of the header line
+    """
+    columns = tuple(header.split()[:3])
+    for name, (first_columns, _, _) in SCHEMAS.items():
+        if columns == first_columns:
+            return name
+    return None
+
+
+def schema_dtypes(header, format, float_dtype=np.float32):
+    """
+    Returns:
+        tuple: (sep, dtype of the columns in the schema, chromosome column) to read a file of format with this header line
+    """
+    if format not in SCHEMAS:
+        raise ValueError(f"format should be one of {list(SCHEMAS)}, got {format}")
+    _, chrom, dtypes = SCHEMAS[format]
+    sep = "\t" if "\t" in header else " "
+    dtype = {c: float_dtype if dtypes[c] is np.float32 else dtypes[c] for c in header.split() if c in dtypes}
+    return sep, dtype, chrom
+
+
+def sort_chromosomes(df, chrom):
+    """
+    Order the categories of the chromosome column as 1 < 2 < ... < 22 < X < Y < XY < MT, in place
+    """
+    if chrom in df.columns:
+        df[chrom] = df[chrom].cat.reorder_categories(sorted(df[chrom].cat.categories, key=sort_key))
+    return df
+
+
+def read_gwas(path, format=None, usecols=None, cache=None, compression="infer", float_dtype=np.float32, verbose=True):
+    """
+    Read a regenie or BOLT-LMM output with fixed dtypes; format=None will find it from the header.
+    A file of other formats is read by pd.read_csv(sep="\\s+") as before.
+
+    Args:
+        usecols: only parse these columns
+        float_dtype: dtype of the float32 columns of the schema, np.float64 keeps the same text when the rows are written out again
+        cache: see gwas_cache.read_cached
+        verbose: write the read speed (bytes/s of the file on disk) to stderr
+
+    Returns:
+        pd.DataFrame
+    """
+    start = time.time()
+    header = read_header(path, compression)
+    if format is None:
+        format = sniff_format(header)
+    if format is None:
+        df = read_cached(path, cache=cache, usecols=usecols, sep=r"\s+", header=0, compression=compression)
+    else:
+        sep, dtype, chrom = schema_dtypes(header, format, float_dtype)
+        if sniff_format(header) != format:
+            raise ValueError(f"{path} is not a {format} output, its header starts with {header.split()[:3]}, should be {list(SCHEMAS[format][0])}")
+        df = read_cached(path, cache=cache, usecols=usecols, sep=sep, header=0, dtype=dtype, compression=compression, engine="c")
+        sort_chromosomes(df, chrom)
+
+    if verbose:
+        seconds = max(time.time() - start, 1e-9)
+        size = os.path.getsize(path)
+        sys.stderr.write(
+            f"read {path} as {format or 'table'}: {len(df)} rows, {size / 1e6:.1f} MB in {seconds:.2f}s, {size / 1e6 / seconds:.1f} MB/s\n"
+        )
+    return df
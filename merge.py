@@ -2,13 +2,18 @@
 # -*- coding: utf-8 -*-
 
 import pandas as pd
+import numpy as np
 import argparse
 import warnings
+import os.path as osp
 
 import sys
 
 from signal import SIG_DFL, SIGPIPE, signal
 
+from gwas_cache import read_cached
+from merge_join import merged_columns, open_text, read_rows, sorted_merge_join
+
 warnings.filterwarnings("ignore")
 
 signal(
@@ -65,23 +70,56 @@ def getParser():
         help="--no_header，没有header的时候使用",
     )
 
+    parser.add_argument(
+        "--stream",
+        dest="stream",
+        action="store_true",
+        help="流式合并：只把较小的文件读入内存建立索引，较大的文件按--chunksize分块读入并输出，只支持--how left/inner，需要-o/--on",
+    )
+    parser.add_argument(
+        "--presorted",
+        dest="presorted",
+        action="store_true",
+        help="两个文件都已经按-o/--on的列排好序（如按chr pos排序的GWAS、pvar、VEP输出）时使用，两个文件同时逐行读入做merge join，内存恒定；遇到顺序不对的行会报错退出。只支持--how left/inner，支持gz",
+    )
+    parser.add_argument(
+        "--cache",
+        dest="cache",
+        nargs="?",
+        const=True,
+        default=None,
+        metavar="DIR",
+        help="把解析后的输入保存为列式缓存(.npcache)，默认放在输入文件旁边，指定DIR则放在DIR中；之后对同一个未修改的文件直接读取缓存，不再解析文本",
+    )
+    parser.add_argument(
+        "--chunksize",
+        dest="chunksize",
+        default=1000000,
+        type=int,
+        help="--stream 时较大文件每次读入的行数, default is 1000000",
+    )
+
     return parser
 
 
-def parse_on_str(on_str):
+def parse_on_str(on_str, left_columns=None, right_columns=None):
     # 解析on_str
     if len(on_str_list := on_str.split(";")) == 1:
         on = on_str_list[0].split(",")
         left_on_idx = on
         right_on_idx = on
     else:
-        left_on_idx, right_on_idx = on_str_list
+        left_on_idx, right_on_idx = [i.split(",") for i in on_str_list]
     # 格式化为int
     left_on_idx = [int(i)-1 for i in left_on_idx]
     right_on_idx = [int(i)-1 for i in right_on_idx]
 
-    left_on = left.columns[left_on_idx].to_list()
-    right_on = right.columns[right_on_idx].to_list()
+    if left_columns is None:
+        left_columns = left.columns
+    if right_columns is None:
+        right_columns = right.columns
+    left_on = left_columns[left_on_idx].to_list()
+    right_on = right_columns[right_on_idx].to_list()
     return left_on, right_on
 
 
@@ -94,11 +132,164 @@ def parse_sep_pattern(sep_expression):
         left_sep = sep_expression_list[0]
         right_sep = left_sep
     else:
-        left_sep, right_sep = sep_expression_list.split(";")
+        left_sep, right_sep = sep_expression_list
 
     return left_sep, right_sep
 
 
+def read_table(path, sep, header, **kwargs):
+    if path.endswith(".gz"):
+        kwargs["compression"] = "gzip"
+    return pd.read_csv(path, sep=sep, header=header, dtype=str, **kwargs)
+
+
+def _join_key(df, on):
+    # NA keys match each other like in pandas merge
+    key = df[on[0]].fillna("\x00")
+    for col in on[1:]:
+        key = key + "\x1f" + df[col].fillna("\x00")
+    return key.to_numpy()
+
+
+class HashIndex:
+    """
+    Hash index over the key columns of the smaller table, built once and probed by each chunk of the larger one.
+
+    Rows of the table are grouped by key (stable, so rows of the same key keep the file order), the unique keys go
+    into a pd.Index whose hash table is built on the first probe and reused by all the chunks.
+    """
+
+    def __init__(self, df, on):
+        self.df = df
+        key = _join_key(df, on)
+        self.order = np.argsort(key, kind="stable")
+        uniq, self.starts, self.counts = np.unique(key[self.order], return_index=True, return_counts=True)
+        self.index = pd.Index(uniq)
+        self.matched = np.zeros(len(df), dtype=bool)
+
+    def probe(self, key):
+        """
+        Returns:
+            tuple: (positions in key, rows of df) of all the matched pairs, in the order of key.
+        """
+        pos = self.index.get_indexer(key)
+        hit = np.flatnonzero(pos >= 0)
+        counts = self.counts[pos[hit]]
+        key_rows = np.repeat(hit, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        df_rows = self.order[np.repeat(self.starts[pos[hit]], counts) + offsets]
+        self.matched[df_rows] = True
+        return key_rows, df_rows
+
+
+def stream_merge(leftPath, rightPath, left_sep, right_sep, header, on_str, how="left", output_sep=" ", chunksize=1000000, out=sys.stdout):
+    """
+    Hash join that only keeps the smaller file in memory: the smaller one is indexed by HashIndex and the larger
+    one is read by chunks, the joined rows of each chunk are written out at once.
+
+    The output has the same rows and columns as the pandas merge. If the left file is the larger one, the row order
+    is the same too; otherwise rows follow the order of the right file, and for --how left the left rows without a
+    match are written at the end.
+    """
+    if how not in ("left", "inner"):
+        raise ValueError("--stream only support --how left or inner")
+
+    def columns(path, sep, suffix):
+        df = read_table(path, sep, header, nrows=0 if header is not None else 1)
+        if header is None:
+            df.columns = [f"{i}{suffix}" for i in range(len(df.columns))]
+        return df.columns
+
+    left_columns = columns(leftPath, left_sep, "_l")
+    right_columns = columns(rightPath, right_sep, "_r")
+    left_on, right_on = parse_on_str(on_str, left_columns, right_columns)
+    right_keep, names = merged_columns(list(left_columns), list(right_columns), left_on, right_on)
+
+    left_is_small = osp.getsize(leftPath) <= osp.getsize(rightPath)
+    if left_is_small:
+        small_path, small_sep, small_columns, small_on = leftPath, left_sep, left_columns, left_on
+        large_path, large_sep, large_columns, large_on = rightPath, right_sep, right_columns, right_on
+    else:
+        small_path, small_sep, small_columns, small_on = rightPath, right_sep, right_columns, right_on
+        large_path, large_sep, large_columns, large_on = leftPath, left_sep, left_columns, left_on
+
+    small = read_table(small_path, small_sep, header)
+    small.columns = small_columns
+    index = HashIndex(small, small_on)
+
+    write_header = header is not None
+    for chunk in read_table(large_path, large_sep, header, chunksize=chunksize):
+        chunk.columns = large_columns
+        large_rows, small_rows = index.probe(_join_key(chunk, large_on))
+        if left_is_small:
+            left_part, right_part = small.iloc[small_rows], chunk.iloc[large_rows]
+        else:
+            if how == "left":  # keep the left rows without a match in place
+                large_rows, small_rows = _left_outer(len(chunk), large_rows, small_rows)
+            left_part, right_part = chunk.iloc[large_rows], _take(small, small_rows)
+        res = pd.concat([left_part.reset_index(drop=True), right_part[right_keep].reset_index(drop=True)], axis=1)
+        res.columns = names
+        res.to_csv(out, sep=output_sep, index=False, header=write_header, na_rep="NA")
+        write_header = False
+
+    if left_is_small and how == "left":
+        unmatched = small[~index.matched].reset_index(drop=True)
+        res = pd.concat([unmatched, pd.DataFrame(index=unmatched.index, columns=right_keep)], axis=1)
+        res.columns = names
+        res.to_csv(out, sep=output_sep, index=False, header=write_header, na_rep="NA")
+
+
+def presorted_merge(leftPath, rightPath, left_sep, right_sep, header, on_str, how="left", output_sep=" ", out=sys.stdout):
+    """
+    Merge join of two files sorted by the -o/--on columns, both are read line by line so the memory is constant.
+    Output is the same as the pandas merge; a row out of order raises ValueError.
+    """
+    with open_text(leftPath) as left_f, open_text(rightPath) as right_f:
+        left_columns, left_rows = read_rows(left_f, left_sep, header is not None)
+        right_columns, right_rows = read_rows(right_f, right_sep, header is not None)
+        if header is None:
+            left_columns = [f"{i}_l" for i in range(left_columns)]
+            right_columns = [f"{i}_r" for i in range(right_columns)]
+
+        left_on, right_on = parse_on_str(on_str, pd.Index(left_columns), pd.Index(right_columns))
+        right_keep, names = merged_columns(left_columns, right_columns, left_on, right_on)
+        if header is not None:
+            out.write(output_sep.join(names) + "\n")
+
+        joined = sorted_merge_join(
+            left_rows,
+            right_rows,
+            [left_columns.index(c) for c in left_on],
+            [right_columns.index(c) for c in right_on],
+            [right_columns.index(c) for c in right_keep],
+            how=how,
+        )
+        for row in joined:
+            out.write(output_sep.join(row) + "\n")
+
+
+def _left_outer(n, rows, other_rows):
+    """
+    Add the rows of range(n) without a match, with -1 as other row, keeping the order of rows.
+    """
+    missing = np.setdiff1d(np.arange(n), rows, assume_unique=False)
+    rows = np.concatenate([rows, missing])
+    other_rows = np.concatenate([other_rows, np.full(len(missing), -1)])
+    order = np.argsort(rows, kind="stable")
+    return rows[order], other_rows[order]
+
+
+def _take(df, rows):
+    """
+    df.iloc[rows] with -1 as a row of NA.
+    """
+    if len(df) == 0:
+        return pd.DataFrame(index=range(len(rows)), columns=df.columns)
+    res = df.iloc[np.where(rows < 0, 0, rows)].reset_index(drop=True)
+    res.loc[rows < 0, :] = np.nan
+    return res
+
+
 if __name__ == "__main__":
     parser = getParser()
     args = parser.parse_args()
@@ -129,6 +320,18 @@ if __name__ == "__main__":
     leftPath=args.left
     rightPath=args.right 
 
+    if args.presorted:
+        if not args.on_str:
+            raise ValueError("--presorted need -o/--on")
+        presorted_merge(leftPath, rightPath, left_sep, right_sep, header, args.on_str, how=how, output_sep=output_sep)
+        sys.exit(0)
+
+    if args.stream:
+        if not args.on_str:
+            raise ValueError("--stream need -o/--on")
+        stream_merge(leftPath, rightPath, left_sep, right_sep, header, args.on_str, how=how, output_sep=output_sep, chunksize=args.chunksize)
+        sys.exit(0)
+
     kwargs_left = {"dtype":str}
     kwargs_right = {"dtype":str}
 
@@ -137,8 +340,8 @@ if __name__ == "__main__":
     if rightPath.endswith(".gz"):
         kwargs_right["compression"] = "gzip"
 
-    left = pd.read_csv(leftPath, sep=sep, header=header, **kwargs_left)
-    right = pd.read_csv(rightPath, sep=sep, header=header, **kwargs_right)
+    left = read_cached(leftPath, cache=args.cache, sep=sep, header=header, **kwargs_left)
+    right = read_cached(rightPath, cache=args.cache, sep=sep, header=header, **kwargs_right)
 
     if header is None:
         left.columns = [f"{i}_l" for i in range(len(left.columns))]
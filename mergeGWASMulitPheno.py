@@ -5,7 +5,11 @@ import textwrap
 import pandas as pd 
 import numpy as np 
 import os.path as osp 
+import time
 import warnings
+from multiprocessing import Pool
+
+from gwas_cache import read_cached
 
 warnings.filterwarnings("ignore")
 
@@ -29,6 +33,9 @@ def getParser():
     parser.add_argument("-o", "--out", dest="out", help="output file", type=str, required=True)
     parser.add_argument("-l","--left-pheno",dest="left", help="left pheno", type=str, required=True)
     parser.add_argument("-p", "--pheno", dest="pheno", nargs="+", help="pheno，与--file 需要匹配", type=str, required=True)
+    parser.add_argument("-t", "--threads", dest="threads", default=1, type=int, help="同时读入的文件数（进程数），default 1")
+    parser.add_argument("--block-size", dest="block_size", default=1000000, type=int, help="每次写出的行数，default 1000000")
+    parser.add_argument("--cache", dest="cache", nargs="?", const=True, default=None, metavar="DIR", help="把解析后的输入保存为列式缓存(.npcache)，默认放在输入文件旁边，指定DIR则放在DIR中；之后对同一个未修改的文件直接读取缓存，不再解析文本")
 
     return parser
 
@@ -37,14 +44,110 @@ def getParser():
 
 
 
-def read_csv(file, **kwargs):
+def read_csv(file, cache=None, **kwargs):
     if file.endswith('.gz'):
         kwargs["compression"] = 'gzip'
 
-    df = pd.read_csv(file, sep='\s+', **kwargs)
+    df = read_cached(file, cache=cache, sep='\s+', **kwargs)
     return df
 
 
+def load_pheno(task):
+    """
+    Read one file and rename its columns after colStart by the pheno; float columns after colStart are downcast to float32.
+
+    Returns:
+        tuple: (DataFrame, seconds)
+    """
+    file, p, colStart, cache = task
+    start = time.time()
+    df = read_csv(file, cache=cache)
+    df = df.rename(columns={i: f"{i}_{p}" for i in df.columns[colStart:]})
+    for col in df.columns[colStart:]:
+        if pd.api.types.is_float_dtype(df[col].dtype):
+            df[col] = df[col].astype(np.float32)
+    return df, time.time() - start
+
+
+def load_phenos(path, pheno, colStart=8, cache=None, threads=1):
+    """
+    load_pheno of each file, threads > 1 will read the files at the same time in a process pool. The order of path is kept.
+    """
+    tasks = [(file, p, colStart, cache) for file, p in zip(path, pheno)]
+    if threads > 1:
+        with Pool(min(threads, len(tasks))) as pool:
+            results = pool.imap(load_pheno, tasks)
+            results = [log_load(task, res) for task, res in zip(tasks, results)]
+    else:
+        results = [log_load(task, load_pheno(task)) for task in tasks]
+    return results
+
+
+def log_load(task, result):
+    df, seconds = result
+    print(f"load {task[0]} as {task[1]}: {df.shape[0]} rows in {seconds:.1f}s")
+    return df
+
+
+def build_index(dfList):
+    """
+    One ID => row index over all files, IDs are in the order they are first seen.
+
+    Returns:
+        tuple: (pd.Index of all IDs, list of the output row of each row of each file)
+    """
+    index = pd.Index(pd.unique(np.concatenate([df["ID"].to_numpy(dtype=object) for df in dfList])))
+    return index, [index.get_indexer(df["ID"]) for df in dfList]
+
+
+def _empty_column(dtype, n):
+    """
+    Column of n missing values, numeric columns become float to hold NaN like pandas merge does.
+    """
+    if pd.api.types.is_bool_dtype(dtype) or not pd.api.types.is_numeric_dtype(dtype):
+        return np.full(n, np.nan, dtype=object)
+    return np.full(n, np.nan, dtype=np.result_type(dtype, np.float32))
+
+
+def fill_columns(dfList, rowsList, n, colStart=8):
+    """
+    Fill the output columns: the first colStart columns of a variant come from the first file it is in,
+    the other columns of each file (already renamed by the pheno) are filled at the rows of that file.
+
+    Returns:
+        dict: column name => array of n rows
+    """
+    columns = {}
+    filled = np.zeros(n, dtype=bool)
+    for df, rows in zip(dfList, rowsList):
+        new = ~filled[rows]
+        new_rows = rows[new]
+        for col in df.columns[:colStart]:
+            values = df[col].to_numpy()
+            dtype = values.dtype if pd.api.types.is_numeric_dtype(values.dtype) else np.dtype(object)
+            if col not in columns:
+                columns[col] = np.empty(n, dtype=dtype)
+            elif columns[col].dtype != dtype:  # like int in one file and float in another
+                columns[col] = columns[col].astype(np.result_type(columns[col].dtype, dtype))
+            columns[col][new_rows] = values[new]
+        filled[rows] = True
+
+        for col in df.columns[colStart:]:
+            values = df[col].to_numpy()
+            columns[col] = _empty_column(values.dtype, n)
+            columns[col][rows] = values
+    return columns
+
+
+def write_blocks(columns, n, out, block_size=1000000, sep="\t"):
+    """
+    Write the columns to out block_size rows at a time, missing values are NA.
+    """
+    for start in range(0, max(n, 1), block_size):
+        block = pd.DataFrame({col: values[start:start + block_size] for col, values in columns.items()})
+        block.to_csv(out, sep=sep, index=False, na_rep="NA", mode="w" if start == 0 else "a", header=start == 0)
+
+
 def getPheno(path):
     return osp.split(path)[1].split('.')[0]
 
@@ -80,26 +183,16 @@ if __name__ == "__main__":
     print(pheno)
     print(path)
 
-    dfList = [read_csv(i) for i in path]
-    dfList = [df.rename(columns={i:f"{i}_{p}" for i in df.columns[colStart:]}) for df,p in zip(dfList, pheno)] # rename columns
-    res= dfList[0].copy()
-    leftPheno=pheno[0]
-    print(leftPheno)
-    for right,p in zip(dfList[1:], pheno[1:]):
-
-        # STEP1 提取与右边有而左边没有的变异，以及左右共有的变异
-        rightUniqID=set(right["ID"]).difference(set(res["ID"]))
-        rightUniq = right["ID"].isin(rightUniqID)
-        rightUniq_df = right[rightUniq]
-        leftRightBoth_df = right[~rightUniq]
-        
-        # STEP2 对于左右共有的变异，直接提取右边需要的列，然后合并到res中
-        res = res.merge(leftRightBoth_df[["ID"] + list(leftRightBoth_df.columns[8:])], on='ID', how='outer')
-        if rightUniq_df.shape[0] != 0:
-            # STEP3 对于右边特有的变异，直接concat到res中，如果没有则跳过
-            ## 首先对rightUniq_df进行处理，重命名需要保存的列
-            print(f"before merge {p}, res.shape is {res.shape}")
-            res = pd.concat([res, rightUniq_df], axis=0, ignore_index=True, sort=False)
-            print(f"after merge {p}, res.shape is {res.shape}")
-    
-    res.to_csv(out, sep='\t', index=False, na_rep='NA')
\ No newline at end of file
+    start = time.time()
+    dfList = load_phenos(path, pheno, colStart, cache=args.cache, threads=args.threads)  # rename columns
+    print(f"load {len(dfList)} files in {time.time() - start:.1f}s")
+
+    # STEP1 所有文件的ID建立一个全局索引，按第一次出现的顺序（左边文件的顺序，然后是每个文件新增的变异）
+    index, rowsList = build_index(dfList)
+    print(f"all {len(index)} variants of {len(dfList)} files")
+
+    # STEP2 每个表型的列填入预先分配好的数组；前colStart列取变异第一次出现的文件
+    columns = fill_columns(dfList, rowsList, len(index), colStart)
+
+    # STEP3 按行分块写出
+    write_blocks(columns, len(index), out, block_size=args.block_size)
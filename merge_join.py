@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Description: sorted merge join of two text tables, shared by merge.py and mergeTable (--presorted)
+@Author      :Tingfeng Xu
+@version      :1.0
+
+Both inputs should be sorted by the key columns (like GWAS outputs, pvar and VEP outputs sorted by chr and pos),
+they are read line by line at the same time, so the memory does not depend on the size of the files.
+Key values are ordered as numbers if they are numbers, chr prefix and X/Y/XY/MT are understood (1 < 2 < 10 < X < Y < XY < MT),
+other values are ordered as strings after them. A row out of this order will raise ValueError with its line number.
+"""
+import gzip
+import re
+import sys
+from itertools import chain
+
+from format_chr import SEX_CODE
+
+NOT_NUMBER = float("inf")
+
+
+def merged_columns(left_columns, right_columns, left_on, right_on):
+    """
+    Columns of left.merge(right, left_on, right_on) as pandas does it: a key with the same name on both sides
+    is kept once, other columns in both sides get suffixes _x and _y.
+
+    Returns:
+        tuple: (kept right columns, output column names)
+    """
+    right_keep = [c for c in right_columns if not (c in right_on and c in left_on and left_on.index(c) == right_on.index(c))]
+    overlap = set(left_columns) & set(right_keep)
+    names = [f"{c}_x" if c in overlap else c for c in left_columns] + [f"{c}_y" if c in overlap else c for c in right_keep]
+    return right_keep, names
+
+
+def sort_key(x):
+    """
+    1 => (1, "1"); chrX => (23, "chrX"); rs123 => (inf, "rs123")
+    """
+    bare = x[3:] if x.startswith("chr") else x
+    if bare.isdigit():
+        return (int(bare), x)
+    if bare in SEX_CODE:
+        return (int(SEX_CODE[bare]), x)
+    return (NOT_NUMBER, x)
+
+
+def open_text(path):
+    """
+    path can be a plain or gzipped file, or None/"-" for stdin.
+    """
+    if path is None or path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt")
+    return open(path)
+
+
+def split_func(sep):
+    if sep is None or sep == r"\s+":
+        return lambda line: line.split()
+    if len(sep) > 1:
+        pattern = re.compile(sep)
+        return lambda line: pattern.split(line.rstrip("\r\n"))
+    return lambda line: line.rstrip("\r\n").split(sep)
+
+
+def read_rows(f, sep=None, header=False):
+    """
+    Returns:
+        tuple: (header row if header else the number of columns of the first row, iterator of (line number, row)),
+            empty lines are skipped.
+    """
+    split = split_func(sep)
+    rows = ((n, split(line)) for n, line in enumerate(f, 1) if line.strip())
+    if header:
+        return next(rows)[1], rows
+    first = next(rows, None)
+    if first is None:
+        return 0, rows
+    return len(first[1]), chain([first], rows)
+
+
+def _groups(rows, on_idx, name):
+    """
+    Yield (key, rows with this key) of consecutive rows, and check the keys are increasing.
+    """
+    key, group, prev_line = None, [], 0
+    for n, row in rows:
+        current = tuple(sort_key(row[i]) for i in on_idx)
+        if current != key:
+            if group:
+                if current < key:
+                    raise ValueError(
+                        f"{name} file is not sorted by the key columns: line {n} {[row[i] for i in on_idx]} is after line {prev_line} {[k[1] for k in key]}"
+                    )
+                yield key, group
+            key, group = current, []
+        group.append(row)
+        prev_line = n
+    if group:
+        yield key, group
+
+
+def sorted_merge_join(left_rows, right_rows, left_on_idx, right_on_idx, right_keep_idx, how="inner", na="NA"):
+    """
+    Merge join of two sorted row iterators (from read_rows), yield output rows: left row + kept columns of right row.
+
+    Equal keys on both sides give all pairs (left order first, then right order) like pandas merge;
+    with how="left" a left row without match gets na for the right columns.
+    """
+    if how not in ("inner", "left"):
+        raise ValueError("sorted merge join only support how = inner or left")
+    na_right = [na] * len(right_keep_idx)
+
+    right = _groups(right_rows, right_on_idx, "right")
+    rkey, rgroup = next(right, (None, None))
+    for lkey, lgroup in _groups(left_rows, left_on_idx, "left"):
+        while rkey is not None and rkey < lkey:
+            rkey, rgroup = next(right, (None, None))
+
+        if rkey == lkey:
+            rgroup = [[r[i] for i in right_keep_idx] for r in rgroup]
+            for l in lgroup:
+                for r in rgroup:
+                    yield l + r
+        elif how == "left":
+            for l in lgroup:
+                yield l + na_right
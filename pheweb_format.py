@@ -11,7 +11,20 @@ import sys
 import warnings
 import textwrap
 from signal import SIG_DFL, SIGPIPE, signal
-import math 
+import glob
+import gzip
+import os
+import os.path as osp
+import struct
+import time
+import zlib
+from functools import partial
+from multiprocessing import Pool
+from operator import itemgetter
+
+import numpy as np
+
+from format_chr import getChromTable
 
 
 
@@ -51,6 +64,9 @@ def getParser():
         Version: 1.0
         Example:zcat _crp.regenie.gz| pheweb_format.py -i 1 2 4 5 6 --log10P --beta '-5' --sebeta '-4' --af 6 --num_samples 7 | column -t
 
+        Batch mode: pheweb_format.py --input step2/ -o pheweb -t 20 -i 1 2 4 5 12 --log10p --beta 10 --sebeta 11 --af 6 --num_samples 7
+            will convert all step2/_<pheno>.regenie.gz in parallel to pheweb/<pheno>.gz (bgzipped, sorted by chrom and pos)
+
 
         Ohter format
             | Column Description                        | Name         | Command Line Argument | Other Allowed Column Names | Allowed Values                                        |
@@ -84,28 +100,12 @@ def getParser():
     parser.add_argument("--num_samples", dest="num_samples", type=int, help="Number of Samples. Integer, must be the same for every variant in its phenotype.")
     parser.add_argument("--num_controls", dest="num_controls", type=int, help="Number of Controls. Integer, must be the same for every variant in its phenotype.")
     parser.add_argument("--num_cases", dest="num_cases", type=int, help="Number of Cases. Integer, must be the same for every variant in its phenotype.")
+    parser.add_argument("--input", dest="input", default=None, help="batch mode: a directory of _<pheno>.regenie.gz files or a glob like 'step2/_*.regenie.gz'; output will be <outdir>/<pheno>.gz (bgzipped, sorted by chrom and pos)")
+    parser.add_argument("-o", "--outdir", dest="outdir", default="pheweb", help="batch mode output dir, default is ./pheweb")
+    parser.add_argument("-t", "--threads", dest="threads", default=1, type=int, help="batch mode threads, files are converted in parallel")
 
     return parser
 
-def formatChr(x, nochr=False):
-    if x.startswith("chr"):
-        return x
-    elif x.isdigit():
-        if int(x) < 23:
-            return "chr" + str(int(x))
-        else:
-            if x == "23":
-                return "chrX"
-            elif x == "24":
-                return "chrY"
-            elif x == "25":
-                return "chrX"
-            elif x == "26":
-                return "chrMT"
-    else:
-        return x
-
-
 # def resetID(line, orderList, IncludeOld=False, is_sort=False, delimter=None,addChr=False):
 #     """
 #     reset ID for any file.
@@ -146,6 +146,140 @@ def formatChr(x, nochr=False):
 #     return outputDelimter.join(ss)
 #     # sys.stdout.write('%s\n'%('\t'.join([ss[x] for x in idIndex])))
 
+def format_lines(lines, project, pval_pos=None):
+    """
+    Project a chunk of data lines to the pheweb columns.
+
+    If pval_pos is given, the pval column is LOG10P and is converted to pval for the whole chunk at once;
+    np.float_power gives the same value as math.pow, so the output is the same as the line by line version.
+    """
+    rows = [project(line.split()) for line in lines]
+    if pval_pos is None:
+        return ["\t".join(row) + "\n" for row in rows]
+
+    log10p = np.fromiter((float(row[pval_pos]) for row in rows), dtype=np.float64, count=len(rows))
+    pvals = np.float_power(10.0, -log10p).tolist()
+    out = []
+    for row, p in zip(rows, pvals):
+        row = list(row)
+        row[pval_pos] = str(p)
+        out.append("\t".join(row) + "\n")
+    return out
+
+
+def format_stream(fin, fout, column_mapping, islog10P=False, block_size=1 << 24):
+    """
+    Read fin in blocks of block_size chars, write the pheweb formated lines to fout with one writelines per block.
+
+    The projection (itemgetter over the not None columns of column_mapping) is built once.
+    """
+    names = [k for k, v in column_mapping.items() if v is not None]
+    project = itemgetter(*[column_mapping[k] for k in names])
+    pval_pos = names.index("pval") if islog10P else None
+
+    is_header = True
+    rest = ""
+    while True:
+        block = fin.read(block_size)
+        if not block:
+            lines = [rest] if rest else []
+        else:
+            block = rest + block
+            cut = block.rfind("\n")
+            if cut == -1:
+                rest = block
+                continue
+            lines = block[:cut].split("\n")
+            rest = block[cut + 1 :]
+
+        if is_header and lines:
+            fout.write("\t".join(names) + "\n")
+            lines = lines[1:]
+            is_header = False
+        fout.writelines(format_lines(lines, project, pval_pos))
+
+        if not block:
+            break
+
+
+BGZF_BLOCK_SIZE = 65280
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def write_bgzf(path, data):
+    """
+    Write bytes to path as bgzip (BGZF) file, so the output can be indexed by tabix like pheweb wants.
+    """
+    with open(path, "wb") as f:
+        for start in range(0, len(data), BGZF_BLOCK_SIZE):
+            block = data[start : start + BGZF_BLOCK_SIZE]
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            cdata = compressor.compress(block) + compressor.flush()
+            f.write(struct.pack("<4BI2BH2BHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(cdata) + 25))
+            f.write(cdata)
+            f.write(struct.pack("<II", zlib.crc32(block) & 0xFFFFFFFF, len(block)))
+        f.write(BGZF_EOF)
+
+
+NUMERIC_CHR = getChromTable("numeric")
+
+
+def chrom_rank(x):
+    code = NUMERIC_CHR[x]
+    return int(code) if code.isdigit() else 27
+
+
+def getPheno(path):
+    """
+    _ldl_a.regenie.gz => ldl_a
+    """
+    name = osp.basename(path)
+    for suffix in (".gz", ".regenie"):
+        if name.endswith(suffix):
+            name = name[: -len(suffix)]
+    return name[1:] if name.startswith("_") else name
+
+
+def convert_file(path, outdir, column_mapping, islog10P=False):
+    """
+    Convert one regenie output to <outdir>/<pheno>.gz, bgzipped and sorted by chrom and pos.
+
+    Returns:
+        tuple: (pheno, rows, seconds)
+    """
+    start_time = time.time()
+    names = [k for k, v in column_mapping.items() if v is not None]
+    project = itemgetter(*[column_mapping[k] for k in names])
+    pval_pos = names.index("pval") if islog10P else None
+
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as f:
+        lines = f.read().split("\n")
+    lines = [line for line in lines[1:] if line]  # drop header
+    out = format_lines(lines, project, pval_pos)
+
+    chrom_pos, pos_pos = names.index("chrom"), names.index("pos")
+    rows = [line.split("\t", pos_pos + 1) for line in out]
+    chrom = np.fromiter((chrom_rank(row[chrom_pos]) for row in rows), dtype=np.int64, count=len(rows))
+    pos = np.fromiter((int(row[pos_pos]) for row in rows), dtype=np.int64, count=len(rows))
+    order = np.lexsort((pos, chrom))
+    if np.any(np.diff(order) < 0):
+        out = [out[i] for i in order]
+
+    pheno = getPheno(path)
+    data = ("\t".join(names) + "\n" + "".join(out)).encode()
+    write_bgzf(osp.join(outdir, f"{pheno}.gz"), data)
+    return pheno, len(out), time.time() - start_time
+
+
+def convert_batch(paths, outdir, column_mapping, islog10P=False, threads=1):
+    os.makedirs(outdir, exist_ok=True)
+    convert = partial(convert_file, outdir=outdir, column_mapping=column_mapping, islog10P=islog10P)
+    with Pool(threads) as p:
+        for pheno, rows, seconds in p.imap_unordered(convert, paths):
+            sys.stderr.write(f"{pheno}\t{rows} rows\t{seconds:.1f}s\t{rows / max(seconds, 1e-9):.0f} rows/s\n")
+
+
 def turn1to0(x):
     if x >=0: # 1=>0 2=>1 
         return x-1
@@ -196,27 +330,16 @@ if __name__ == "__main__":
     column_mapping["num_cases"] = turn1to0(args.num_cases) if args.num_cases is not None else None
 
     islog10P = args.log10P
-    delimter = None 
-
-    line_idx = 1 
-    for line in sys.stdin:
-        ss = line.split(delimter) 
-        formated_ss = []
-        for k, v in column_mapping.items():
-
-            if line_idx ==1:
-                if v is not None:
-                    formated_ss.append(k)
-            else:
-                if v is not None:
-                    if (k == "pval") and islog10P: # 第一行跳过
-                        formated_ss.append(str(math.pow(10, -float(ss[v]))))
-                    else:
-                        formated_ss.append(ss[v]) 
-
-        formated_ss = delimter.join(formated_ss) if delimter is not None else "\t".join(formated_ss)
-        sys.stdout.write(f"{formated_ss}\n")
-        line_idx += 1
+    if args.input is not None:
+        if osp.isdir(args.input):
+            paths = sorted(glob.glob(osp.join(args.input, "_*.regenie.gz")))
+        else:
+            paths = sorted(glob.glob(args.input))
+        if not paths:
+            raise ValueError(f"no file found by --input {args.input}")
+        convert_batch(paths, args.outdir, column_mapping, islog10P, args.threads)
+    else:
+        format_stream(sys.stdin, sys.stdout, column_mapping, islog10P)
 
 
 sys.stdout.close()
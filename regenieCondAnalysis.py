@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Description: conditional analysis by regenie, the epoch loop of regenieCondAnalysis.sh
+@Author      :Tingfeng Xu
+@version      :1.0
+
+Each epoch runs regenie step 2 conditioned on the leading SNPs found so far, its output is parsed once into arrays:
+    leading SNP     the max LOG10P of the SNPs with A1FREQ > --defaultFREQ and LOG10P > --defaultLOG10P (argmax instead of sort -k12gr)
+    exclude         --exclude-mode: SNPs with LOG10P < cutoff are excluded from the next epochs, the set is kept in memory
+    --step2-cache   epoch 0 links the cached step 2 output of the phenotype (see regenie_step2.py), a missing one is run with --cache-phenos
+                    in one regenie run and saved to the cache, so the conditional analysis of many phenotypes shares one genome scan
+    --window        region mode: epoch N+1 only tests (--extract) the SNPs not excluded and within --window bp of the leading SNP of epoch N,
+                    the rows of the other SNPs are carried forward from the epochs before; when no SNP passes the filter (or --max-condsnp
+                    is reached) the epoch is run again on all SNPs, so the last epoch and ${pheno}.cond.regeine are from a full regenie run
+After each epoch the state is saved to ${out}/checkpoint.json, a run killed in the middle will go on from the last finished epoch.
+Output files are the same as regenieCondAnalysis.sh: leading.regenie, exclude.regenie, leading.snplist and ${pheno}.cond.regeine
+"""
+import argparse
+import gzip
+import json
+import os
+import os.path as osp
+import shutil
+import subprocess
+import textwrap
+import time
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+from regenie_step2 import cached_step2, fill_step2_cache, link_file, regenie_cmd
+
+CHROM_COL, POS_COL, ID_COL, FREQ_COL, LOG10P_COL = 0, 1, 2, 5, 11  # $1 $2 $3 $6 $12 of regenie output
+
+
+def getParser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(
+            """
+        %prog conditional analysis by regenie
+        @Author: xutingfeng@big.ac.cn
+        Version: 1.0
+        Example:
+        1. ./regenieCondAnalysis.py -p SORT_pgen --phenoFile regenie_qt.tsv --pheno ldl_a -t 20 --step1 step1/qt_step1_pred.list -o test/test_qt --exclude-mode 1
+        2. 中断后再次运行同样的命令会从 ${out}/checkpoint.json 记录的最后完成的epoch继续；--restart 则从头开始
+        3. reuse the step 2 output of 20 lipid traits: ./regenieCondAnalysis.py ... --pheno ldl_a --step2-cache ./step2_cache --cache-phenos apob tg hdl ...
+        4. region mode, epoch 1.. only test the SNPs within 1Mb of the last leading SNP: ./regenieCondAnalysis.py ... --exclude-mode 1 --window 1000000
+
+        """
+        ),
+    )
+    parser.add_argument("-p", "--pfile", dest="pgenPath", required=True, help="plink pfile path")
+    parser.add_argument("--phenoFile", dest="phenoFile", required=True, help="pheno file path")
+    parser.add_argument("--pheno", dest="pheno", required=True, help="pheno name")
+    parser.add_argument("-t", "--threads", dest="threads", default=20, type=int, help="threads, default 20")
+    parser.add_argument("--step1", dest="predFile", required=True, help="step1 pred file path")
+    parser.add_argument("--step2", dest="step2File", default=None, help="step2 output of epoch 0, optional")
+    parser.add_argument("--step2-cache", dest="step2Cache", default=None, help="step 2 cache dir, epoch 0 links the cached output instead of running regenie")
+    parser.add_argument(
+        "--cache-phenos",
+        dest="cachePhenos",
+        nargs="+",
+        default=[],
+        help="other phenos run together with --pheno when its step 2 output is not in --step2-cache, their outputs are saved to the cache too",
+    )
+    parser.add_argument("-o", "--out", dest="outputPath", default="./conditionalAnalysis", help="output prefix, default ./conditionalAnalysis")
+    parser.add_argument("--exclude-mode", dest="excludeLOG10PCUTOFF", default=None, type=float, help="exclude mode, SNPs with LOG10P < this are excluded from the next epochs")
+    parser.add_argument("--max-condsnp", dest="maxcount", default=100, type=int, help="max cond snp, default 100")
+    parser.add_argument("--defaultLOG10P", dest="defaultLOG10P", default=6, type=float, help="default log10p cutoff, default 6")
+    parser.add_argument("--defaultFREQ", dest="defaultFREQ", default=1e-2, type=float, help="default freq cutoff, default 1e-2")
+    parser.add_argument("--bt", dest="bt", action="store_true", help="bt mode, default is qt")
+    parser.add_argument("--keep", dest="keep", default=None, help="keep ID file")
+    parser.add_argument("--cov", dest="covarFile", default=osp.join(osp.dirname(osp.abspath(__file__)), "sup", "regenie.cov"), help="cov file")
+    parser.add_argument(
+        "--window",
+        dest="window",
+        default=None,
+        type=int,
+        help="region mode, epoch N+1 only tests the SNPs not excluded and within this many bp of the leading SNP of epoch N, default off (all SNPs)",
+    )
+    parser.add_argument("--regenie", dest="regenie", default="regenie", help="regenie binary, default regenie in PATH")
+    parser.add_argument("--restart", dest="restart", action="store_true", help="ignore the checkpoint and run from epoch 0")
+    return parser
+
+
+class EpochOutput:
+    """
+    One regenie step 2 output parsed once: the raw lines (to write them out as they are) and the ID/A1FREQ/LOG10P arrays.
+    """
+
+    def __init__(self, path):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt") as f:
+            text = f.read()
+        lines = text.splitlines()
+        self.header = lines[0]
+        self.lines = np.array(lines[1:], dtype=object)
+        cols = pd.read_csv(
+            StringIO(text), sep=" ", usecols=[CHROM_COL, POS_COL, ID_COL, FREQ_COL, LOG10P_COL], dtype={CHROM_COL: str, ID_COL: str}
+        )
+        self.chrom = cols.iloc[:, 0].to_numpy(dtype=object)
+        self.pos = cols.iloc[:, 1].to_numpy(dtype=np.int64)
+        self.ids = cols.iloc[:, 2].to_numpy(dtype=object)
+        self.freq = cols.iloc[:, 3].to_numpy(dtype=np.float64)
+        self.log10p = cols.iloc[:, 4].to_numpy(dtype=np.float64)
+
+    def leading(self, freqCUTOFF, LOG10PCUTOFF):
+        """
+        Row of the leading SNP: max LOG10P of the rows with A1FREQ > freqCUTOFF and LOG10P > LOG10PCUTOFF, None if no row passes.
+        """
+        passed = (self.freq > freqCUTOFF) & (self.log10p > LOG10PCUTOFF)
+        if not passed.any():
+            return None
+        return int(np.argmax(np.where(passed, self.log10p, -np.inf)))
+
+    def below(self, cutoff):
+        return self.log10p < cutoff
+
+    def near(self, chrom, pos, window):
+        """
+        IDs on chrom within window bp of pos
+        """
+        return self.ids[(self.chrom == chrom) & (np.abs(self.pos - pos) <= window)]
+
+    def drop(self, ids):
+        keep = ~pd.Index(self.ids).isin(ids)
+        for name in ("lines", "chrom", "pos", "ids", "freq", "log10p"):
+            setattr(self, name, getattr(self, name)[keep])
+
+    def update(self, other, extracted):
+        """
+        Carry the rows forward: rows of the extracted IDs are replaced by the rows of other (the regenie output of them),
+        extracted IDs not in other are dropped like regenie drops them in a full run, other rows are kept in place.
+        """
+        idx = pd.Index(self.ids).get_indexer(other.ids)
+        new = idx < 0
+        keep = ~pd.Index(self.ids).isin(extracted)
+        keep[idx[~new]] = True
+        for name in ("lines", "chrom", "pos", "ids", "freq", "log10p"):
+            values = getattr(self, name).copy()
+            values[idx[~new]] = getattr(other, name)[~new]
+            setattr(self, name, np.concatenate([values[keep], getattr(other, name)[new]]))
+
+    def write(self, path):
+        with open(path, "w") as f:
+            f.write(f"{self.header}\n")
+            for line in self.lines:
+                f.write(f"{line}\n")
+
+
+def write_lines(path, lines, suffix, mode="a"):
+    with open(path, mode) as f:
+        for line in lines:
+            f.write(f"{line} {suffix}\n")
+
+
+def save_checkpoint(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def truncate(path, size):
+    """
+    Drop what a killed epoch appended after the last checkpoint.
+    """
+    if osp.exists(path) and osp.getsize(path) > size:
+        with open(path, "r+") as f:
+            f.truncate(size)
+
+
+def run_regenie(args, currentDir, condList=None, excludeList=None, extractList=None):
+    subprocess.run(regenie_cmd(args, currentDir, condList, excludeList, extractList), check=True)
+
+
+def run_epoch(args, count, leadingIDs, excludeIDs, extractIDs=None):
+    """
+    Run regenie of epoch count and return the path of its gzipped output; with extractIDs only these SNPs are tested.
+    """
+    currentDir = osp.join(args.outputPath, f"cond_{count}")
+    os.makedirs(currentDir, exist_ok=True)
+    output = osp.join(currentDir, f"_{args.pheno}.regenie")
+
+    if count == 0 and (args.step2File or args.step2Cache):
+        step2File = args.step2File
+        if step2File:
+            print(f"存在step2File, link {step2File}")
+            if not osp.isfile(step2File):
+                raise FileNotFoundError(f"step2File:{step2File} 不存在")
+        else:
+            step2File = cached_step2(args.step2Cache, args, args.pheno)
+            if step2File is None:
+                phenos = [args.pheno] + [p for p in args.cachePhenos if p != args.pheno]
+                step2File = fill_step2_cache(args, phenos, args.step2Cache)[args.pheno]
+            else:
+                print(f"step 2 output of {args.pheno} in the cache: {step2File}")
+        # linked, not gzipped in place: the file is shared with the cache or the --step2 file
+        output = output + ".gz" if step2File.endswith(".gz") else output
+        link_file(step2File, output)
+        return output
+    else:
+        condList = excludeList = extractList = None
+        if count > 0:
+            condList = osp.join(currentDir, "cond.snplist")
+            with open(condList, "w") as f:
+                f.writelines(f"{i}\n" for i in leadingIDs)
+        if extractIDs is not None:
+            # leading SNPs are in the list so that regenie can read them for --condition-list
+            extractList = osp.join(currentDir, "extract.snplist")
+            with open(extractList, "w") as f:
+                f.writelines(f"{i}\n" for i in extractIDs)
+                f.writelines(f"{i}\n" for i in leadingIDs)
+            print(f"extract {len(extractIDs)} SNPs in {count} conditionalAnalysis")
+        elif args.excludeLOG10PCUTOFF is not None and count > 0:
+            excludeList = osp.join(currentDir, "exclude.snplist")
+            with open(excludeList, "w") as f:
+                f.writelines(f"{i}\n" for i in excludeIDs)
+            print(f"exclude {len(excludeIDs)} SNPs in {count} conditionalAnalysis")
+        run_regenie(args, currentDir, condList, excludeList, extractList)
+
+    if osp.getsize(output) > 0:
+        subprocess.run(["gzip", "-f", output], check=True)
+    return output + ".gz"
+
+
+def read_ids(path):
+    """
+    IDs ($3) of leading.regenie or exclude.regenie, without header
+    """
+    if not osp.exists(path):
+        return []
+    with open(path) as f:
+        next(f, None)
+        return [line.split(" ")[ID_COL] for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    parser = getParser()
+    args = parser.parse_args()
+
+    exclude_mode = args.excludeLOG10PCUTOFF is not None
+    outputPath = args.outputPath
+    os.makedirs(outputPath, exist_ok=True)
+    leadingFile = osp.join(outputPath, "leading.regenie")
+    excludeSNPFile = osp.join(outputPath, "exclude.regenie")
+    checkpointFile = osp.join(outputPath, "checkpoint.json")
+    settings = {k: v for k, v in vars(args).items() if k not in ("threads", "restart", "regenie")}
+
+    state = None
+    if osp.exists(checkpointFile) and not args.restart:
+        with open(checkpointFile) as f:
+            state = json.load(f)
+        if state["settings"] != settings:
+            raise ValueError(f"{checkpointFile} is from a run with other settings, use --restart to run from epoch 0")
+
+    if state is None:
+        count = 0
+        leadingIDs, excludeIDs = [], set()
+        leadSite = None
+        done = False
+    else:
+        truncate(leadingFile, state["leading_size"])
+        if exclude_mode:
+            truncate(excludeSNPFile, state["exclude_size"])
+        count = state["epoch"] + 1
+        done = state["done"]
+        leadingIDs = read_ids(leadingFile)
+        excludeIDs = set(read_ids(excludeSNPFile))
+        leadSite = state["lead_site"]
+        print(f"resume from {checkpointFile}: epoch {state['epoch']} finished, {len(leadingIDs)} leading SNPs, {len(excludeIDs)} excluded SNPs")
+
+    currentRegenieOutPut = state["output"] if state else None
+    table = EpochOutput(currentRegenieOutPut) if currentRegenieOutPut else None  # rows of the last epoch, carried forward in region mode
+    if table is not None:
+        table.drop(excludeIDs)  # the raw output of a full epoch still has the SNPs excluded at that epoch
+    while not done and count <= args.maxcount:
+        print(f"-------------BEGIN OF epoch :{count} -------------")
+        start = time.time()
+        region = args.window is not None and count > 0
+        if region:
+            # the leading SNP may be dropped from table by --exclude-mode, its window comes from leadSite
+            conditioned = set(leadingIDs)
+            extractIDs = [i for i in table.near(*leadSite, args.window) if i not in conditioned]
+            currentRegenieOutPut = run_epoch(args, count, leadingIDs, excludeIDs, extractIDs)
+            epoch = EpochOutput(currentRegenieOutPut)
+            table.update(epoch, set(extractIDs) | conditioned)
+            lead = table.leading(args.defaultFREQ, args.defaultLOG10P)
+            if lead is None or count == args.maxcount:
+                print(f"run epoch {count} again on all SNPs, the last epoch should be a full run")
+                region = False
+        if not region:
+            currentRegenieOutPut = run_epoch(args, count, leadingIDs, excludeIDs)
+            epoch = table = EpochOutput(currentRegenieOutPut)
+            lead = table.leading(args.defaultFREQ, args.defaultLOG10P)
+
+        if count == 0:
+            with open(leadingFile, "w") as f:
+                f.write(f"{epoch.header} FAILDTIME\n")
+        if lead is not None:
+            write_lines(leadingFile, [table.lines[lead]], "leading")
+            leadingIDs.append(table.ids[lead])
+            leadSite = [table.chrom[lead], int(table.pos[lead])]
+            print(f"epoch\tID\tFREQ\tLOG10P\ncond_{count}\t{table.ids[lead]}\t{table.freq[lead]}\t{table.log10p[lead]}")
+
+        if exclude_mode:
+            # only the SNPs tested in this epoch can fail, the carried rows have passed before
+            failed = epoch.below(args.excludeLOG10PCUTOFF)
+            if count == 0:
+                with open(excludeSNPFile, "w") as f:
+                    f.write(f"{epoch.header} FAILDTIME\n")
+            write_lines(excludeSNPFile, epoch.lines[failed], count)
+            excludeIDs.update(epoch.ids[failed])
+            table.drop(epoch.ids[failed])
+
+        done = lead is None
+        if done:
+            print(f"No SNP passed the filter at epoch {count}!!!!!")
+        if region:
+            currentRegenieOutPut = osp.join(outputPath, f"cond_{count}", "carried.regenie")
+            table.write(currentRegenieOutPut)
+        print(f"-------------END OF epoch:{count}  ------------- {time.time() - start:.1f}s")
+
+        save_checkpoint(
+            checkpointFile,
+            {
+                "settings": settings,
+                "epoch": count,
+                "done": done,
+                "output": currentRegenieOutPut,
+                "lead_site": leadSite,
+                "leading_size": osp.getsize(leadingFile),
+                "exclude_size": osp.getsize(excludeSNPFile) if exclude_mode else 0,
+            },
+        )
+        count += 1
+
+    with open(osp.join(outputPath, "leading.snplist"), "w") as f:
+        f.writelines(f"{i}\n" for i in leadingIDs)
+
+    # merge all: leading + the last epoch (keep) + exclude
+    finalFile = osp.join(outputPath, f"{args.pheno}.cond.regeine")
+    epoch = table if table is not None else EpochOutput(currentRegenieOutPut)
+    with open(finalFile, "w") as out:
+        with open(leadingFile) as f:
+            shutil.copyfileobj(f, out)
+        if exclude_mode:
+            keep = ~epoch.below(args.excludeLOG10PCUTOFF)
+            finalKeepFile = osp.join(outputPath, "keep.regenie")
+            write_lines(finalKeepFile, [epoch.header], "FAILDTIME", mode="w")
+            write_lines(finalKeepFile, epoch.lines[keep], "keep")
+            out.writelines(f"{line} keep\n" for line in epoch.lines[keep])
+            with open(excludeSNPFile) as f:
+                next(f, None)
+                shutil.copyfileobj(f, out)
+        else:
+            out.writelines(f"{line} keep\n" for line in epoch.lines)
+
+    print("Finished!")
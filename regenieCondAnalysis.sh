@@ -19,6 +19,7 @@ usage() {
     -t, --threads <threads>         threads, default value is 20
     --step1 <step1>                 step1 pred file path, must be specified
     --step2 <step2>                 step2 pred file path, optional
+    --step2-cache <dir>             step2 结果缓存目录, epoch 0 直接链接缓存中的结果, 没有则运行regenie并存入缓存, optional
     -o, --out <out>                 output prefix, default value is ./conditionalAnalysis
     --exclude-mode <log10p_cutoff>  exclude mode, optional parameter, log10p_cutoff
     --max-condsnp  <value>           max cond snp, default value is 100
@@ -27,6 +28,7 @@ usage() {
     --bt                             bt mode, default is false, and be qt model
     --keep <keepFile>                   keep ID file, 用于限定使用的人群，如果不指定则使用全体样本
     --cov <covFile>                   cov file
+    --window <bp>                     region mode, epoch N+1 只检验未被排除且在上一个leading SNP附近 <bp> 内的SNP, 其余SNP沿用之前epoch的结果, 默认关闭
 
 
 示例:
@@ -39,6 +41,8 @@ usage() {
 
     parallel run bt:
     parallel -q echo "sbatch -J '{1}_{2}_regenie' -c 10 --mem=15G -o log/%j_{1}_{2}.log --wrap 'regenieCondAnalysis.sh -p /pmaster/xutingfeng/dataset/ukb/dataset/snp/wgs/GRCh38/{1} --phenoFile /pmaster/xutingfeng/dataset/ukb/phenotype/regenie_bt.tsv --pheno {2} -t 10 --step1 ./step1/bt_step1_pred.list -o ./conditionalNew/{1}/{2} --bt  --exclude-mode 1 '" ::: APOB PCSK9 LDLR SORT1 ::: cad mi |parallel 
+    单节点上按CPU和内存预算运行 gene x pheno, 跳过已有结果 (--sbatch <dir> 则写出sbatch脚本):
+    regenieScheduler.py -p /pmaster/xutingfeng/dataset/ukb/dataset/snp/wgs/GRCh38/{gene} --genes APOB PCSK9 LDLR SORT1 --phenos ldl_a apob --phenoFile /pmaster/xutingfeng/dataset/ukb/phenotype/regenie_qt.tsv --step1 ./step1/qt_step1_pred.list -t 10 --job-mem 15 -o ./conditionalNew --exclude-mode 1
 注意:
     1. 所有参数都是必需的，除非另有说明。
     2. 默认参数值已在帮助文档中指定。
@@ -120,6 +124,15 @@ while [[ $# -gt 0 ]]; do
         step2File=$2
         echo "$1 $2"
 
+        shift 2
+        ;;
+    --step2-cache)
+        if [[ -z "$2" || "$2" == -* ]]; then
+            echo "错误: --step2-cache 参数需要提供一个值" >&2
+            exit 1
+        fi
+        step2Cache=$2
+        echo "$1 $2"
         shift 2
         ;;
     -o | --out)
@@ -194,6 +207,15 @@ while [[ $# -gt 0 ]]; do
         echo ${covarFile}
         shift 2
         ;;
+    --window)
+        if [[ -z "$2" || "$2" == -* ]]; then
+            echo "错误: --window 参数需要提供一个值" >&2
+            exit 1
+        fi
+        window=$2
+        echo "$1 $2"
+        shift 2
+        ;;
     -h | --help)
         usage
         ;;
@@ -245,158 +267,26 @@ fi
 # Export environments variable for regenie
 alias regenie=${scriptPath}/bin/regenie_v3.2.6.gz_x86_64_Linux_mkl
 
-mkdir -p ${outputPath}
-leadingFile=${outputPath}/leading.regenie
-for ((count = 0; count <= ${maxcount}; count++)); do
-    # while [[ -n "${LOG10P}" && -n "${FREQ}" ]] && [ ${count} -le ${maxcount} ]; do
-    # run regenie
-    echo "-------------BEGIN OF epoch :${count} -------------"
-    currentDir=${outputPath}/cond_${count}
-
-    if [[ "${count}" -eq 0 ]]; then
-        # Step1 run regenie step2
-        mkdir -p ${currentDir}
-        # 不存在step2File则直接运行step2
-        if [[ -z "${step2File}" ]]; then
-            regenie --step 2 \
-                --threads=${threads} \
-                --ref-first \
-                --pgen ${pgenPath} \
-                --phenoFile ${phenoFile} \
-                --phenoCol ${pheno} \
-                ${keep_files} \
-                ${regenie_mode} \
-                --covarFile ${covarFile} \
-                --covarColList genotype_array,inferred_sex,age_visit,PC1,PC2,PC3,PC4,PC5,PC6,PC7,PC8,PC9,PC10,assessment_center,age_squared \
-                --catCovarList genotype_array,inferred_sex,assessment_center \
-                --maxCatLevels 30 \
-                --bsize 1000 \
-                --out ${currentDir}/ \
-                --minMAC 1 \
-                --pred ${predFile}
-        else
-            echo "存在step2File，cp file" # this is not good, TODO: change to ln or others
-            if [[ ! -f "${step2File}" ]]; then
-                echo "step2File:${step2File} 不存在"
-                exit 1
-            fi
-            if [[ ${step2File} == *.gz ]]; then
-                cp ${step2File} ${currentDir}/_${pheno}.regenie.gz
-            else
-                cp ${step2File} ${currentDir}/_${pheno}.regenie
-            fi
-        fi
-
-    else
-        mkdir -p ${currentDir}
-        currentCondList=${currentDir}/cond.snplist
-        tail -n +2 ${leadingFile} | awk '{print $3}' >${currentCondList}
-
-        if [ "$exclude_mode" = true ]; then
-            # 提取当前需要用到的excludeSNPList
-            excludeSNPListCurrent=${currentDir}/exclude.snplist
-            tail -n +2 ${excludeSNPFile} | awk '{print $3}' >${excludeSNPListCurrent}
-
-            echo "exclude $(cat ${excludeSNPListCurrent} | wc -l) SNPs in ${count} conditionalAnalysis"
-
-            # Step2.2 conditional analysis
-            echo "running ${count} ........"
-            regenie --step 2 \
-                --threads=${threads} \
-                --ref-first \
-                --pgen ${pgenPath} \
-                --phenoFile ${phenoFile} \
-                --phenoCol ${pheno} \
-                --condition-list ${currentCondList} \
-                --exclude ${excludeSNPListCurrent} \
-                ${keep_files} \
-                ${regenie_mode} \
-                --covarFile ${covarFile} \
-                --covarColList genotype_array,inferred_sex,age_visit,PC1,PC2,PC3,PC4,PC5,PC6,PC7,PC8,PC9,PC10,assessment_center,age_squared \
-                --catCovarList genotype_array,inferred_sex,assessment_center \
-                --maxCatLevels 30 \
-                --bsize 1000 \
-                --out ${currentDir}/ \
-                --minMAC 1 \
-                --pred ${predFile}
-            # >/dev/null
-
-        else
-            # Step2.2 conditional analysis
-            # echo "running ${count} ........"
-            regenie --step 2 \
-                --threads=${threads} \
-                --ref-first \
-                --pgen ${pgenPath} \
-                --phenoFile ${phenoFile} \
-                --phenoCol ${pheno} \
-                --condition-list ${currentCondList} \
-                ${keep_files} \
-                ${regenie_mode} \
-                --covarFile ${covarFile} \
-                --covarColList genotype_array,inferred_sex,age_visit,PC1,PC2,PC3,PC4,PC5,PC6,PC7,PC8,PC9,PC10,assessment_center,age_squared \
-                --catCovarList genotype_array,inferred_sex,assessment_center \
-                --maxCatLevels 30 \
-                --bsize 1000 \
-                --out ${currentDir}/ \
-                --minMAC 1 \
-                --pred ${predFile}
-            # >/dev/null
-
-        fi
-
-    fi
-    # 对输出处理
-
-    currentRegenieOutPut=${currentDir}/_${pheno}.regenie
-
-    if [[ -s ${currentRegenieOutPut} ]]; then
-        gzip ${currentRegenieOutPut}
-    fi
-
-    # 写入header
-
-    if [[ "${count}" -eq 0 ]]; then # 写入header
-        read currentSNP FREQ LOG10P <<<"$(zcat ${currentRegenieOutPut}.gz | awk 'NR==1{print;next}NR>=2{print | "sort -k12gr"}' | awk -v freqCUTOFF=${defaultFREQ} -v LOG10PCUTOFF=${defaultLOG10P} 'NR==1{print $0, "FAILDTIME";next}{if ($6 > freqCUTOFF && $12 >LOG10PCUTOFF){print $0, "leading";exit}}' | tee ${leadingFile} | awk 'BEGIN{OFS=" "}NR==2{print $3, $6, $12}')"
-    else # 不写入header
-        read currentSNP FREQ LOG10P <<<"$(zcat ${currentRegenieOutPut}.gz | awk 'NR>=2{print | "sort -k12gr"}' | awk -v freqCUTOFF=${defaultFREQ} -v LOG10PCUTOFF=${defaultLOG10P} '{if ($6 > freqCUTOFF && $12 >LOG10PCUTOFF){print $0, "leading";exit}}' | tee -a ${leadingFile} | awk 'BEGIN{OFS=" "}{print $3, $6, $12}')"
-    fi
-    # 提取排除 的SNP
-    if [[ "$exclude_mode" = true ]]; then
-        if [[ "${count}" -eq 0 ]]; then
-            zcat "${currentRegenieOutPut}".gz | awk -v excludeLOG10PCUTOFF="${excludeLOG10PCUTOFF}" 'NR==1{print $0, "FAILDTIME";next}$12 <excludeLOG10PCUTOFF {print $0, "0"}' >${excludeSNPFile} # 提取对应的最后一次所有的信息，最后一列为FAILDTIME；说明是在那一次被过滤掉的。
-        else
-            # 如果exclude_mode open 则提取当前的excludeSNPList
-            zcat "${currentRegenieOutPut}".gz | awk -v excludeLOG10PCUTOFF="${excludeLOG10PCUTOFF}" -v currentCount=${count} 'NR==1{next}$12 <excludeLOG10PCUTOFF {print $0, currentCount}' >>"${excludeSNPFile}" # 提取对应的最后一次所有的信息
-        fi
-    fi
-    # 更新计数器
-    if [[ -n "${LOG10P}" && -n "${FREQ}" ]]; then
-        echo -e "epoch\tID\tFREQ\tLOG10P\ncond_${count}\t${currentSNP}\t${FREQ}\t${LOG10P}" | column -t
-        echo "-------------END OF epoch:${count}  -------------"
-
-    else
-        echo "No SNP passed the filter at epoch ${count}!!!!!"
-        echo "-------------END OF epoch:${count}  -------------"
-
-        break
-    fi
-done
-leadingSNPList=${outputPath}/leading.snplist
-tail -n +2 ${leadingFile} | awk '{print $3}' >${leadingSNPList}
-
-finalFile=${outputPath}/${pheno}.cond.regeine
-# 如果exclude_mode open 则提取当前的excludeSNPList
+# epoch loop 由 regenieCondAnalysis.py 完成：每个epoch的输出只解析一次，并在 ${outputPath}/checkpoint.json 记录进度，中断后再次运行会从最后完成的epoch继续
+pyArgs=(-p "${pgenPath}" --phenoFile "${phenoFile}" --pheno "${pheno}" -t "${threads}" --step1 "${predFile}" -o "${outputPath}"
+    --max-condsnp "${maxcount}" --defaultLOG10P "${defaultLOG10P}" --defaultFREQ "${defaultFREQ}" --cov "${covarFile}")
+if [[ -n "${step2File}" ]]; then
+    pyArgs+=(--step2 "${step2File}")
+fi
 if [ "$exclude_mode" = true ]; then
-    # excludeSNPList_current=${outputPath}/exclude.snplist
-    finalKeepFile=${outputPath}/keep.regenie
-
-    zcat "${currentRegenieOutPut}".gz | awk -v excludeLOG10PCUTOFF="${excludeLOG10PCUTOFF}" -v currentCount=${count} 'NR==1{print $0, "FAILDTIME";next}$12 >=excludeLOG10PCUTOFF {print $0, "keep"}' >${finalKeepFile}
-    # merge all
-    cat ${leadingFile} <(tail -n +2 ${finalKeepFile}) <(tail -n +2 ${excludeSNPFile}) >${finalFile}
-
-else
-    cat ${leadingFile} <(zcat "${currentRegenieOutPut}".gz | awk 'NR>=2{print $0, "keep"}') >${finalFile}
+    pyArgs+=(--exclude-mode "${excludeLOG10PCUTOFF}")
+fi
+if [[ "${regenie_mode}" == --bt* ]]; then
+    pyArgs+=(--bt)
+fi
+if [[ -n "${keep_files}" ]]; then
+    pyArgs+=(${keep_files})
+fi
+if [[ -n "${step2Cache}" ]]; then
+    pyArgs+=(--step2-cache "${step2Cache}")
+fi
+if [[ -n "${window}" ]]; then
+    pyArgs+=(--window "${window}")
 fi
 
-echo "Finished!"
+python ${scriptPath}/regenieCondAnalysis.py "${pyArgs[@]}" || exit $?
@@ -34,6 +34,8 @@ usage() {
 
     parallel run bt:
     parallel -q echo "sbatch -J '{1}_{2}_regenie' -c 10 --mem=15G -o log/%j_{1}_{2}.log --wrap 'regenieCondAnalysis.sh -p /pmaster/xutingfeng/dataset/ukb/dataset/snp/wgs/GRCh38/{1} --phenoFile /pmaster/xutingfeng/dataset/ukb/phenotype/regenie_bt.tsv --pheno {2} -t 10 --step1 ./step1/bt_step1_pred.list -o ./conditionalNew/{1}/{2} --bt  --exclude-mode 1 '" ::: APOB PCSK9 LDLR SORT1 ::: cad mi |parallel 
+    单节点上按CPU和内存预算运行 gene x pheno, 跳过已有结果 (--sbatch <dir> 则写出sbatch脚本):
+    regenieScheduler.py -p /pmaster/xutingfeng/dataset/ukb/dataset/snp/wgs/GRCh38/{gene} --genes APOB PCSK9 LDLR SORT1 --phenos ldl_a apob --phenoFile /pmaster/xutingfeng/dataset/ukb/phenotype/regenie_qt.tsv --step1 ./step1/qt_step1_pred.list -t 10 --job-mem 15 -o ./conditionalNew --no-cond
 注意:
     1. 所有参数都是必需的，除非另有说明。
     2. 默认参数值已在帮助文档中指定。
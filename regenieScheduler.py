@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Description: run regenie step 2 and the conditional analysis of a gene x phenotype grid on one node, or write sbatch scripts of it
+@Author      :Tingfeng Xu
+@version      :1.0
+
+Each (gene, pheno) pair is two tasks, the second one depends on the first:
+    step2   regenie step 2 of ${pfile} with --phenoCol ${pheno}      => ${out}/${gene}/${pheno}/step2/_${pheno}.regenie.gz
+    cond    regenieCondAnalysis.py --step2 <output of step2>      => ${out}/${gene}/${pheno}/cond/${pheno}.cond.regeine
+With --step2-cache the step2 task is one regenie run of all phenotypes of a gene (regenie_step2.py), saved to the cache,
+and the cond tasks of the gene link their epoch 0 from the cache, so all phenotypes share one genome scan.
+A task runs when its dependency has finished and the free CPUs and memory of the budget are enough for it (-t threads, --job-mem GB),
+so at most min(--cpus / -t, --mem / --job-mem) regenie run at the same time and the node is not oversubscribed.
+Tasks with valid outputs are skipped: a non-empty step2 output with the regenie header, a cond ${pheno}.cond.regeine newer than its checkpoint.json.
+The log of a task is ${out}/log/${gene}_${pheno}_${task}.log.
+"""
+import argparse
+import os
+import os.path as osp
+import shlex
+import subprocess
+import sys
+import textwrap
+import time
+from argparse import Namespace
+
+from merge_join import open_text
+from regenie_step2 import cached_step2, regenie_cmd
+
+CONDSCRIPT = osp.join(osp.dirname(osp.abspath(__file__)), "regenieCondAnalysis.py")
+STEP2SCRIPT = osp.join(osp.dirname(osp.abspath(__file__)), "regenie_step2.py")
+
+
+def getParser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(
+            """
+        %prog run regenie step 2 + conditional analysis of genes x phenotypes within a CPU and memory budget
+        @Author: xutingfeng@big.ac.cn
+        Version: 1.0
+        Example:
+        1. qt on this node, 10 threads per regenie: ./regenieScheduler.py -p /pmaster/xutingfeng/dataset/ukb/dataset/snp/wgs/GRCh38/{gene} --genes APOB PCSK9 LDLR SORT1 --phenos ldl_a apob --phenoFile regenie_qt.tsv --step1 ./step1/qt_step1_pred.list -t 10 -o ./conditionalNew --exclude-mode 1
+        2. bt, only print the tasks: ./regenieScheduler.py ... --bt --dry-run
+        3. write sbatch scripts instead of running: ./regenieScheduler.py ... --sbatch ./sbatch && bash ./sbatch/submit.sh
+        4. 只运行step2, 不做条件分析: ./regenieScheduler.py ... --no-cond
+        5. one step 2 run per gene for all phenos: ./regenieScheduler.py ... --phenos ldl_a apob tg hdl --step2-cache ./step2_cache
+
+        """
+        ),
+    )
+    parser.add_argument("-p", "--pfile", dest="pgenPath", required=True, help="plink pfile path of the genes, {gene} is replaced by the gene name")
+    parser.add_argument("--genes", dest="genes", nargs="+", required=True, help="gene names, or a file with one gene per line")
+    parser.add_argument("--phenos", dest="phenos", nargs="+", required=True, help="pheno names, or a file with one pheno per line")
+    parser.add_argument("--phenoFile", dest="phenoFile", required=True, help="pheno file path")
+    parser.add_argument("--step1", dest="predFile", required=True, help="step1 pred file path")
+    parser.add_argument("-o", "--out", dest="outputPath", default="./conditionalAnalysis", help="output dir, default ./conditionalAnalysis")
+    parser.add_argument("-t", "--threads", dest="threads", default=10, type=int, help="--threads of each regenie, default 10")
+    parser.add_argument("--cpus", dest="cpus", default=os.cpu_count(), type=int, help=f"CPUs of the budget, default all CPUs ({os.cpu_count()})")
+    parser.add_argument("--mem", dest="mem", default=None, type=float, help="memory of the budget in GB, default the available memory")
+    parser.add_argument("--job-mem", dest="jobMem", default=15, type=float, help="memory of each regenie in GB, default 15")
+    parser.add_argument("--bt", dest="bt", action="store_true", help="bt mode, default is qt")
+    parser.add_argument("--keep", dest="keep", default=None, help="keep ID file")
+    parser.add_argument("--cov", dest="covarFile", default=osp.join(osp.dirname(osp.abspath(__file__)), "sup", "regenie.cov"), help="cov file")
+    parser.add_argument("--regenie", dest="regenie", default="regenie", help="regenie binary, default regenie in PATH")
+    parser.add_argument("--step2-cache", dest="step2Cache", default=None, help="step 2 cache dir, run step 2 of all phenos of a gene at once into it")
+    parser.add_argument("--no-cond", dest="cond", action="store_false", help="only run step 2")
+    parser.add_argument("--exclude-mode", dest="excludeLOG10PCUTOFF", default=None, help="--exclude-mode of regenieCondAnalysis.py")
+    parser.add_argument("--max-condsnp", dest="maxcount", default=None, help="--max-condsnp of regenieCondAnalysis.py")
+    parser.add_argument("--defaultLOG10P", dest="defaultLOG10P", default=None, help="--defaultLOG10P of regenieCondAnalysis.py")
+    parser.add_argument("--defaultFREQ", dest="defaultFREQ", default=None, help="--defaultFREQ of regenieCondAnalysis.py")
+    parser.add_argument("--window", dest="window", default=None, help="--window of regenieCondAnalysis.py")
+    parser.add_argument("--sbatch", dest="sbatch", default=None, help="write one sbatch script per (gene, pheno) and submit.sh to this dir instead of running them")
+    parser.add_argument("--dry-run", dest="dryRun", action="store_true", help="print the tasks and exit")
+    return parser
+
+
+class Task:
+    """
+    Commands of one step of a (gene, pheno) pair, run one by one in a shell.
+    """
+
+    def __init__(self, name, cmds, done, deps=(), threads=1, mem=0):
+        self.name = name
+        self.cmds = cmds
+        self.done = done  # callable, True if the outputs are valid
+        self.deps = list(deps)
+        self.threads = threads
+        self.mem = mem
+        self.status = "wait"  # wait, run, ok, failed, skip
+        self.proc = None
+        self.start = None
+
+    def script(self):
+        return " && ".join(" ".join(shlex.quote(str(x)) for x in cmd) for cmd in self.cmds)
+
+
+def read_names(values):
+    """
+    --genes APOB PCSK9 or --genes genes.txt
+    """
+    if len(values) == 1 and osp.isfile(values[0]):
+        with open(values[0]) as f:
+            return [line.strip() for line in f if line.strip()]
+    return values
+
+
+def available_mem():
+    """
+    MemAvailable of /proc/meminfo in GB
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024**2
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024**3
+
+
+def step2_done(path):
+    if not osp.exists(path) or osp.getsize(path) == 0:
+        return False
+    try:
+        with open_text(path) as f:
+            return f.readline().startswith("CHROM GENPOS ID")
+    except (OSError, EOFError):
+        return False
+
+
+def cond_done(path, pheno):
+    """
+    ${pheno}.cond.regeine is written after the last epoch, so it is newer than checkpoint.json
+    """
+    finalFile = osp.join(path, f"{pheno}.cond.regeine")
+    checkpoint = osp.join(path, "checkpoint.json")
+    if not (osp.exists(finalFile) and osp.exists(checkpoint)) or osp.getsize(finalFile) == 0:
+        return False
+    return os.stat(finalFile).st_mtime_ns >= os.stat(checkpoint).st_mtime_ns
+
+
+def build_tasks(args, genes, phenos):
+    """
+    Returns:
+        list: Task of step2 and cond of each (gene, pheno), the cond task depends on the step2 task;
+            with --step2-cache one step2 task per gene for all phenos
+    """
+    tasks = []
+    for gene in genes:
+        regenieArgs = Namespace(**vars(args))
+        regenieArgs.pgenPath = args.pgenPath.format(gene=gene)
+        if args.step2Cache:
+            cmd = [sys.executable, STEP2SCRIPT, "-p", regenieArgs.pgenPath, "--phenoFile", args.phenoFile, "--phenos", *phenos]
+            cmd += ["-t", args.threads, "--step1", args.predFile, "--cache", args.step2Cache, "--cov", args.covarFile, "--regenie", args.regenie]
+            if args.keep:
+                cmd += ["--keep", args.keep]
+            if args.bt:
+                cmd.append("--bt")
+            geneStep2 = Task(
+                f"{gene}_step2",
+                [cmd],
+                done=lambda regenieArgs=regenieArgs: all(cached_step2(args.step2Cache, regenieArgs, pheno) for pheno in phenos),
+                threads=args.threads,
+                mem=args.jobMem,
+            )
+            tasks.append(geneStep2)
+
+        for pheno in phenos:
+            pairDir = osp.join(args.outputPath, gene, pheno)
+            if args.step2Cache:
+                step2 = geneStep2
+            else:
+                step2Dir = osp.join(pairDir, "step2")
+                step2File = osp.join(step2Dir, f"_{pheno}.regenie")
+                regenieArgs.pheno = pheno
+                step2 = Task(
+                    f"{gene}_{pheno}_step2",
+                    [["mkdir", "-p", step2Dir], regenie_cmd(regenieArgs, step2Dir), ["gzip", "-f", step2File]],
+                    done=lambda path=step2File + ".gz": step2_done(path),
+                    threads=args.threads,
+                    mem=args.jobMem,
+                )
+                tasks.append(step2)
+            if not args.cond:
+                continue
+
+            condDir = osp.join(pairDir, "cond")
+            cmd = [sys.executable, CONDSCRIPT, "-p", regenieArgs.pgenPath, "--phenoFile", args.phenoFile, "--pheno", pheno]
+            cmd += ["-t", args.threads, "--step1", args.predFile, "-o", condDir]
+            cmd += ["--step2-cache", args.step2Cache] if args.step2Cache else ["--step2", step2File + ".gz"]
+            cmd += ["--cov", args.covarFile, "--regenie", args.regenie]
+            for flag, value in (
+                ("--exclude-mode", args.excludeLOG10PCUTOFF),
+                ("--max-condsnp", args.maxcount),
+                ("--defaultLOG10P", args.defaultLOG10P),
+                ("--defaultFREQ", args.defaultFREQ),
+                ("--window", args.window),
+                ("--keep", args.keep),
+            ):
+                if value is not None:
+                    cmd += [flag, value]
+            if args.bt:
+                cmd.append("--bt")
+            tasks.append(
+                Task(f"{gene}_{pheno}_cond", [cmd], done=lambda path=condDir, pheno=pheno: cond_done(path, pheno), deps=[step2], threads=args.threads, mem=args.jobMem)
+            )
+    return tasks
+
+
+def write_sbatch(tasks, sbatchDir, logDir):
+    """
+    One sbatch script per task not done yet, and submit.sh to sbatch them with --dependency=afterok on the jobs of their dependencies.
+    """
+    os.makedirs(sbatchDir, exist_ok=True)
+    os.makedirs(logDir, exist_ok=True)  # slurm fails the job if the dir of -o does not exist
+    jobs = {}  # task => index of its job id variable in submit.sh
+    with open(osp.join(sbatchDir, "submit.sh"), "w") as submit:
+        submit.write("#!/bin/bash\nset -e\n")
+        for task in tasks:
+            if task.status == "skip":
+                continue
+            path = osp.join(sbatchDir, f"{task.name}.sh")
+            with open(path, "w") as f:
+                f.write("#!/bin/bash\n")
+                f.write(f"#SBATCH -J {task.name}_regenie\n")
+                f.write(f"#SBATCH -c {task.threads}\n")
+                f.write(f"#SBATCH --mem={int(task.mem)}G\n")
+                f.write(f"#SBATCH -o {osp.join(logDir, f'%j_{task.name}.log')}\n")
+                f.write("set -e\n")
+                f.write(task.script() + "\n")
+
+            deps = [f"${{jid{jobs[dep]}}}" for dep in task.deps if dep in jobs]
+            dependency = f"--dependency=afterok:{':'.join(deps)} " if deps else ""
+            jobs[task] = len(jobs)
+            submit.write(f"jid{jobs[task]}=$(sbatch --parsable {dependency}{shlex.quote(path)})\n")
+    print(f"write {len(jobs)} sbatch scripts to {sbatchDir}, run: bash {osp.join(sbatchDir, 'submit.sh')}")
+
+
+def run_tasks(tasks, cpus, mem, logDir, interval=1):
+    """
+    Run the tasks in order, a task starts when its dependencies are ok and the free CPUs and memory are enough.
+    A task bigger than the whole budget runs alone.
+
+    Returns:
+        list: failed tasks
+    """
+    os.makedirs(logDir, exist_ok=True)
+    freeCPU, freeMem = cpus, mem
+    running = []
+    while True:
+        for task in tasks:
+            if task.status != "wait":
+                continue
+            if any(dep.status in ("failed", "skip-failed") for dep in task.deps):
+                task.status = "skip-failed"
+                print(f"skip {task.name}: its dependency failed")
+                continue
+            if any(dep.status not in ("ok", "skip") for dep in task.deps):
+                continue
+            if running and (task.threads > freeCPU or task.mem > freeMem):
+                continue
+            log = open(osp.join(logDir, f"{task.name}.log"), "w")
+            task.proc = subprocess.Popen(task.script(), shell=True, stdout=log, stderr=subprocess.STDOUT)
+            log.close()
+            task.status, task.start = "run", time.time()
+            freeCPU -= task.threads
+            freeMem -= task.mem
+            running.append(task)
+            print(f"start {task.name}: {task.threads} threads, {task.mem}G; {len(running)} running, {freeCPU} CPUs and {freeMem:.0f}G free")
+
+        if not running:
+            break
+        time.sleep(interval)
+        for task in running[:]:
+            code = task.proc.poll()
+            if code is None:
+                continue
+            running.remove(task)
+            freeCPU += task.threads
+            freeMem += task.mem
+            task.status = "ok" if code == 0 else "failed"
+            print(f"{'finish' if code == 0 else 'FAILED'} {task.name} in {time.time() - task.start:.0f}s, exit code {code}")
+    return [task for task in tasks if task.status in ("failed", "skip-failed")]
+
+
+if __name__ == "__main__":
+    parser = getParser()
+    args = parser.parse_args()
+
+    genes, phenos = read_names(args.genes), read_names(args.phenos)
+    tasks = build_tasks(args, genes, phenos)
+    for task in tasks:
+        if task.done() and all(dep.status == "skip" for dep in task.deps):
+            task.status = "skip"
+        elif args.step2Cache and task.deps and task.done():
+            task.status = "skip"  # the cache key checks the inputs, a new pheno of the gene does not make the others out of date
+        elif task.name.endswith("_cond") and not args.step2Cache and any(dep.status != "skip" for dep in task.deps):
+            task.cmds[-1].append("--restart")  # step 2 runs again, the checkpoint of the cond is out of date
+    skipped = sum(task.status == "skip" for task in tasks)
+    print(f"{len(genes)} genes x {len(phenos)} phenos: {len(tasks)} tasks, {skipped} of them have valid outputs and are skipped")
+
+    logDir = osp.join(args.outputPath, "log")
+    if args.dryRun:
+        for task in tasks:
+            print(f"{task.status}\t{task.name}\t{task.script()}")
+        sys.exit(0)
+    if args.sbatch:
+        write_sbatch(tasks, args.sbatch, logDir)
+        sys.exit(0)
+
+    mem = args.mem if args.mem is not None else available_mem()
+    print(f"budget: {args.cpus} CPUs, {mem:.0f}G memory")
+    failed = run_tasks(tasks, args.cpus, mem, logDir)
+    if failed:
+        print(f"{len(failed)} tasks failed or skipped: {', '.join(task.name for task in failed)}, see {logDir}")
+        sys.exit(1)
+    print("Finished!")
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Description: regenie step 2 command line and the cache of its outputs, shared by regenieCondAnalysis.py and regenieScheduler.py
+@Author      :Tingfeng Xu
+@version      :1.0
+
+The step 2 output of a phenotype without conditioning (epoch 0 of the conditional analysis) only depends on its inputs,
+so it is saved once in a cache directory as <key>.regenie.gz, key = md5 of:
+    pgen (.pgen/.pvar/.psam), phenoFile, covarFile, keep file, step1 pred list and the LOCO files in it: path, size and mtime
+    phenotype name and the regenie flags (--qt/--bt..., covariate columns, --minMAC ...)
+The files are identified by size and mtime instead of hashing their content, touching the pgen makes a new key.
+One regenie run with several --phenoCol fills the cache of many phenotypes at once (one genome scan for all of them),
+and the conditional analysis links the cached output to cond_0 (hardlink, symlink if it is on another file system) instead of cp.
+
+Usage:
+    ./regenie_step2.py -p SORT_pgen --phenoFile regenie_qt.tsv --phenos ldl_a apob tg hdl --step1 step1/qt_step1_pred.list --cache ./step2_cache
+    ./regenieCondAnalysis.py ... --pheno ldl_a --step2-cache ./step2_cache
+"""
+import argparse
+import hashlib
+import json
+import os
+import os.path as osp
+import shutil
+import subprocess
+import tempfile
+import textwrap
+
+COVAR_COLS = "genotype_array,inferred_sex,age_visit,PC1,PC2,PC3,PC4,PC5,PC6,PC7,PC8,PC9,PC10,assessment_center,age_squared"
+CAT_COVAR_COLS = "genotype_array,inferred_sex,assessment_center"
+
+
+def getParser():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(
+            """
+        %prog run regenie step 2 of several phenotypes at once and save the outputs to the step 2 cache
+        @Author: xutingfeng@big.ac.cn
+        Version: 1.0
+        Example:
+        1. 20 lipid traits in one genome scan: ./regenie_step2.py -p SORT_pgen --phenoFile regenie_qt.tsv --phenos ldl_a apob tg hdl ... --step1 step1/qt_step1_pred.list -t 20 --cache ./step2_cache
+        2. then: ./regenieCondAnalysis.py -p SORT_pgen --phenoFile regenie_qt.tsv --pheno ldl_a --step1 step1/qt_step1_pred.list --step2-cache ./step2_cache --exclude-mode 1
+
+        """
+        ),
+    )
+    parser.add_argument("-p", "--pfile", dest="pgenPath", required=True, help="plink pfile path")
+    parser.add_argument("--phenoFile", dest="phenoFile", required=True, help="pheno file path")
+    parser.add_argument("--phenos", dest="phenos", nargs="+", required=True, help="pheno names")
+    parser.add_argument("-t", "--threads", dest="threads", default=20, type=int, help="threads, default 20")
+    parser.add_argument("--step1", dest="predFile", required=True, help="step1 pred file path")
+    parser.add_argument("--cache", dest="cache", required=True, help="step 2 cache dir")
+    parser.add_argument("--bt", dest="bt", action="store_true", help="bt mode, default is qt")
+    parser.add_argument("--keep", dest="keep", default=None, help="keep ID file")
+    parser.add_argument("--cov", dest="covarFile", default=osp.join(osp.dirname(osp.abspath(__file__)), "sup", "regenie.cov"), help="cov file")
+    parser.add_argument("--regenie", dest="regenie", default="regenie", help="regenie binary, default regenie in PATH")
+    return parser
+
+
+def regenie_cmd(args, currentDir, condList=None, excludeList=None, extractList=None, phenos=None):
+    """
+    regenie step 2 command line of args (see regenieCondAnalysis.getParser), the output is ${currentDir}/_${pheno}.regenie;
+    phenos: test these phenotypes in one run instead of args.pheno
+    """
+    cmd = [
+        args.regenie,
+        "--step", "2",
+        f"--threads={args.threads}",
+        "--ref-first",
+        "--pgen", args.pgenPath,
+        "--phenoFile", args.phenoFile,
+    ]
+    for pheno in phenos or [args.pheno]:
+        cmd += ["--phenoCol", pheno]
+    if condList:
+        cmd += ["--condition-list", condList]
+    if excludeList:
+        cmd += ["--exclude", excludeList]
+    if extractList:
+        cmd += ["--extract", extractList]
+    if args.keep:
+        cmd += ["--keep", args.keep]
+    cmd += ["--bt", "--firth", "--approx", "--pThresh", "0.01"] if args.bt else ["--qt"]
+    cmd += [
+        "--covarFile", args.covarFile,
+        "--covarColList", COVAR_COLS,
+        "--catCovarList", CAT_COVAR_COLS,
+        "--maxCatLevels", "30",
+        "--bsize", "1000",
+        "--out", currentDir + "/",
+        "--minMAC", "1",
+        "--pred", args.predFile,
+    ]
+    return cmd
+
+
+def _file_id(path):
+    if path is None:
+        return None
+    path = osp.abspath(path)
+    if not osp.exists(path):
+        return [path, None, None]
+    stat = os.stat(path)
+    return [path, stat.st_size, stat.st_mtime_ns]
+
+
+def _pred_files(predFile):
+    """
+    LOCO files listed in the step1 pred list, lines like: ldl_a /path/step1_1.loco.gz
+    """
+    try:
+        with open(predFile) as f:
+            return [line.split()[1] for line in f if len(line.split()) > 1]
+    except OSError:
+        return []
+
+
+def step2_key(args, pheno):
+    """
+    Cache key of the step 2 output of pheno without conditioning, --threads and --out do not change the output
+    """
+    cmd = regenie_cmd(args, "", phenos=[pheno])
+    flags = [x for x in cmd[1:] if not x.startswith("--threads=")]
+    inputs = {
+        "pgen": [_file_id(f"{args.pgenPath}.{ext}") for ext in ("pgen", "pvar", "psam")],
+        "phenoFile": _file_id(args.phenoFile),
+        "covarFile": _file_id(args.covarFile),
+        "keep": _file_id(args.keep),
+        "pred": [_file_id(args.predFile)] + [_file_id(f) for f in _pred_files(args.predFile)],
+    }
+    key = json.dumps([pheno, flags, inputs], sort_keys=True)
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def cached_step2(cache, args, pheno):
+    """
+    Returns:
+        str: path of the cached step 2 output of pheno, None if it is not in the cache
+    """
+    path = osp.join(cache, f"{step2_key(args, pheno)}.regenie.gz")
+    return path if osp.exists(path) else None
+
+
+def link_file(src, dst):
+    """
+    Hardlink src to dst, symlink if they are on different file systems; dst is replaced if it exists.
+    Readers only, never write into dst: a hardlink shares the data with the cache.
+    """
+    if osp.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        os.symlink(osp.abspath(src), dst)
+
+
+def fill_step2_cache(args, phenos, cache):
+    """
+    Run regenie step 2 of the phenos not in the cache yet in one run, and save their outputs to the cache.
+
+    Returns:
+        dict: pheno => path of the cached output
+    """
+    os.makedirs(cache, exist_ok=True)
+    cached = {pheno: cached_step2(cache, args, pheno) for pheno in phenos}
+    missing = [pheno for pheno, path in cached.items() if path is None]
+    if not missing:
+        return cached
+
+    print(f"step 2 of {len(missing)} phenos in one regenie run: {','.join(missing)}")
+    tmp = tempfile.mkdtemp(dir=cache, prefix=".tmp")
+    try:
+        subprocess.run(regenie_cmd(args, tmp, phenos=missing), check=True)
+        for pheno in missing:
+            output = osp.join(tmp, f"_{pheno}.regenie")
+            subprocess.run(["gzip", "-f", output], check=True)
+            key = step2_key(args, pheno)
+            os.replace(output + ".gz", osp.join(cache, f"{key}.regenie.gz"))
+            with open(osp.join(cache, f"{key}.json"), "w") as f:
+                json.dump({"pheno": pheno, "pgen": args.pgenPath, "phenoFile": args.phenoFile, "cmd": regenie_cmd(args, "", phenos=[pheno])}, f, indent=2)
+            cached[pheno] = osp.join(cache, f"{key}.regenie.gz")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return cached
+
+
+if __name__ == "__main__":
+    parser = getParser()
+    args = parser.parse_args()
+
+    for pheno, path in fill_step2_cache(args, args.phenos, args.cache).items():
+        print(f"{pheno}\t{path}")
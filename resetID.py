@@ -2,11 +2,18 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import gc
+import gzip
+import os.path as osp
 import sys
 import warnings
 import textwrap
+from multiprocessing import Pool
+from operator import itemgetter, methodcaller
 from signal import SIG_DFL, SIGPIPE, signal
 
+from format_chr import getChromTable
+
 # need to change a lot !
 
 
@@ -66,6 +73,9 @@ def getParser():
             --keep 保留原始ID
             --header 有header的时候，它会默认忽略第一行，直接输出；而使用--comment的时候，直接输出所有以comment开头的所有行；二者不可以同时使用。
             Assume IDCol should be: chr:pos:ref:alt
+
+        4. for a large pvar file, use `resetID.py -f test.pvar -t 32 -i 3 1 2 4 5 --comment '#' > new.pvar`
+            -f 指定输入文件（不是gz的时候）会按字节切分成多份，-t 个进程并行处理，输出顺序与原文件一致
     
         """
         ),
@@ -111,6 +121,21 @@ def getParser():
         help="comment char, default is '#'.",
     )
     parser.add_argument("--add-chr", dest="addChr", action="store_true", help="add chr for chr col of ID")
+    parser.add_argument(
+        "-f",
+        "--file",
+        dest="file",
+        default=None,
+        help="input file, default is stdin. A not gzipped file can be split into shards and processed by -t threads.",
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        dest="threads",
+        default=1,
+        type=int,
+        help="threads for -f/--file, the file will be split by bytes into shards and the output keeps the original order.",
+    )
     parser.add_argument(
         "--header",
         dest="header",
@@ -119,67 +144,124 @@ def getParser():
     )
     return parser
 
-def formatChr(x, nochr=False):
-    if nochr:
-        return x.replace("chr", "")
-    else:
-        if x.startswith("chr"):
-            return x
-        elif x.isdigit():
-            if int(x) < 23:
-                return "chr" + str(int(x))
-            else:
-                if x == "23":
-                    return "chrX"
-                elif x == "24":
-                    return "chrY"
-                elif x == "25":
-                    return "chrXY"
-                elif x == "26":
-                    return "chrMT"
-        else:
-            return x
-
-
-def resetID(line, orderList, IncludeOld=False, is_sort=False, delimter=None,addChr=False):
+def resetID_block(lines, orderList, IncludeOld=False, is_sort=False, delimter=None, chromTable=None):
     """
-    reset ID for any file.
-    setID as : chr:pos:ref:alt
-    return
+    Block version of resetID, works on a list of stripped lines column by column and returns the output text of the block.
+
+    chromTable is getChromTable("chr" if addChr else "nochr"). All the loops over the columns are done by map/zip so they run in C.
     """
-    # output results.
-    ss = line.split(delimter)
-    
-    # orderList should contain at least one element, which is ID col
-    if len(orderList) ==1:
+    rows = [line.split(delimter) for line in lines]
+
+    if len(orderList) == 1:
         idCol = orderList[0]
-        oldID = ss[idCol]
-        chr, pos, A0, A1 = oldID.split(':') # this time A0 and A1 is not sure, and this mode should work for --sort or --add-chr or do nothing 
+        oldID = list(map(itemgetter(idCol), rows))
+        # unpack by 4 like resetID, so a bad ID raises ValueError instead of being truncated by zip
+        chr, pos, A0, A1 = zip(*[(c, p, a0, a1) for c, p, a0, a1 in map(methodcaller("split", ":"), oldID)])
     else:
-        idCol, chrCol, posCol, refCol, altCol = orderList
+        idCol = orderList[0]
+        oldID, chr, pos, A0, A1 = zip(*map(itemgetter(*orderList), rows))
 
-        oldID, chr, pos, A0, A1 = ss[idCol], ss[chrCol], ss[posCol], ss[refCol], ss[altCol] # this time A0 is REF and A1 is ALT; this work for rename ID 
-    
     if is_sort:
-        stemp = sorted([A0, A1])
-    else:
-        stemp = [A0, A1]
+        A0, A1 = map(min, A0, A1), map(max, A0, A1)
 
-    # if addChr:
-    chr = formatChr(chr, not addChr) # addChr is True, then nochr is False, so formatChr will add chr for chr col of ID
+    newID = map(":".join, zip(map(chromTable.__getitem__, chr), pos, A0, A1))
+    if IncludeOld:
+        newID = map(":".join, zip(newID, oldID))
 
-    newID = chr + ':' + pos + ':' + stemp[0] + ':' + stemp[1]
-    if IncludeOld:  # 是否包含oldID
-        newID = newID + ':' + oldID  
-    # 更新到ss中
-    ss[idCol] = newID
+    outputDelimter = "\t" if delimter is None else delimter
+    for ss, n in zip(rows, newID):
+        ss[idCol] = n
+    return "\n".join(map(outputDelimter.join, rows)) + "\n"
+
+
+def resetID_stream(fin, fout, orderList, IncludeOld=False, is_sort=False, delimter=None, chromTable=None, comment=None, skip_row=0):
+    # header and comment lines before the first record are passed through line by line
+    lines = []
+    for line in fin:
+        if skip_row > 0:
+            skip_row -= 1
+            continue
+
+        line = line.strip()
+        if line:
+            if comment is not None and line.startswith(comment):
+                fout.write(f"{line}\n")
+            else:
+                lines.append(line)
+                break
+
+    # then the records are reset by block
+    while lines:
+        block = [line for line in (line.strip() for line in lines) if line]
+        if block:
+            fout.write(
+                resetID_block(
+                    block,
+                    orderList=orderList,
+                    IncludeOld=IncludeOld,
+                    is_sort=is_sort,
+                    delimter=delimter,
+                    chromTable=chromTable,
+                )
+            )
+        lines = fin.readlines(1 << 18)
+
+
+def _resetID_shard(task):
+    """
+    Worker of resetID_file_parallel: reset the records in bytes [start, end) of path and return the output text.
+    """
+    path, start, end, kwargs, addChr = task
+    with open(path, "rb") as f:
+        f.seek(start)
+        lines = f.read(end - start).decode().split("\n")
+    chromTable = getChromTable("chr" if addChr else "nochr")
+    out = []
+    for i in range(0, len(lines), 5000):
+        block = [line for line in (line.strip() for line in lines[i : i + 5000]) if line]
+        if block:
+            out.append(resetID_block(block, chromTable=chromTable, **kwargs))
+    return "".join(out)
 
-    if delimter is None:
-        outputDelimter = "\t"
-    else:
-        outputDelimter = delimter
-    return outputDelimter.join(ss)
-    # sys.stdout.write('%s\n'%('\t'.join([ss[x] for x in idIndex])))
+
+def resetID_file_parallel(path, fout, orderList, IncludeOld=False, is_sort=False, delimter=None, addChr=False, comment=None, skip_row=0, threads=2, shard_size=1 << 26):
+    """
+    Split the records of path into byte ranges aligned on newlines and reset them in threads worker processes.
+
+    Header and comment lines are written once by the main process, the shards are written back in the original order.
+    """
+    with open(path, "rb") as f:
+        # find where the records start, same rules as resetID_stream
+        while True:
+            start = f.tell()
+            line = f.readline()
+            if not line:
+                return
+            if skip_row > 0:
+                skip_row -= 1
+                continue
+            line = line.decode().strip()
+            if line:
+                if comment is not None and line.startswith(comment):
+                    fout.write(f"{line}\n")
+                else:
+                    break
+
+        size = osp.getsize(path)
+        n = max(threads * 4, (size - start) // shard_size + 1)
+        bounds = [start]
+        for b in range(1, n):
+            f.seek(max(start + (size - start) * b // n, bounds[-1]))
+            f.readline()  # move to the start of next line
+            bounds.append(min(f.tell(), size))
+        bounds.append(size)
+    fout.flush()
+
+    kwargs = dict(orderList=orderList, IncludeOld=IncludeOld, is_sort=is_sort, delimter=delimter)
+    tasks = [(path, s, e, kwargs, addChr) for s, e in zip(bounds[:-1], bounds[1:]) if e > s]
+    with Pool(threads) as p:
+        for out in p.imap(_resetID_shard, tasks):
+            fout.write(out)
 
 
 if __name__ == "__main__":
@@ -206,39 +288,16 @@ if __name__ == "__main__":
         skip_row = 0
 
     orderList = [int(i) - 1 for i in expr]
-    output = False
-    for line in sys.stdin:
-        if skip_row > 0:
-            skip_row -= 1
-            continue
-
-        line = line.strip()
-        if line:
-            if output:
-                ss = resetID(
-                    line=line,
-                    orderList=orderList,
-                    IncludeOld=IncludeOld,
-                    is_sort=is_sort,
-                    delimter=delimter,
-                    addChr=addChr,
-                )
-                sys.stdout.write(f"{ss}\n")
+    gc.disable()  # no reference cycles here, and the gc passes over the rows of each block cost more than the work itself
 
-            else:
-                if comment is not None and line.startswith(comment):
-                    sys.stdout.write(f"{line}\n")
-                else:
-                    output = True
-                    ss = resetID(
-                        line=line,
-                        orderList=orderList,
-                        IncludeOld=IncludeOld,
-                        is_sort=is_sort,
-                        delimter=delimter,
-                        addChr=addChr,
-                    )
-                    sys.stdout.write(f"{ss}\n")
+    kwargs = dict(orderList=orderList, IncludeOld=IncludeOld, is_sort=is_sort, delimter=delimter)
+    if args.file is not None and args.threads > 1 and not args.file.endswith(".gz"):
+        resetID_file_parallel(args.file, sys.stdout, comment=comment, skip_row=skip_row, threads=args.threads, addChr=addChr, **kwargs)
+    elif args.file is not None:
+        with (gzip.open if args.file.endswith(".gz") else open)(args.file, "rt") as f:
+            resetID_stream(f, sys.stdout, comment=comment, skip_row=skip_row, chromTable=getChromTable("chr" if addChr else "nochr"), **kwargs)
+    else:
+        resetID_stream(sys.stdin, sys.stdout, comment=comment, skip_row=skip_row, chromTable=getChromTable("chr" if addChr else "nochr"), **kwargs)
 
 
 sys.stdout.close()
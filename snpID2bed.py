@@ -7,6 +7,8 @@ import warnings
 import textwrap
 from signal import SIG_DFL, SIGPIPE, signal
 
+from format_chr import getChromTable
+
 # need to change a lot !
 
 
@@ -65,6 +67,10 @@ def getParser():
             1 108274969 108274969 T C 1:108274969:T:C 1 108274969 0 C T 0.0442549 1 3.48143 6.2E-02 0.011646 0.0062442 3.47857 6.2E-02 3.47861 6.2E-02
             1 108274984 108274984 A T 1:108274984:A:T 1 108274984 0 T A 0.000147941 1 0.10202 7.5E-01 0.0372084 0.1168 0.101484 7.5E-01 0.101477 7.5E-01
             1 108275002 108275002 C T 1:108275002:C:T 1 108275002 0 T C 4.40473e-05 1 0.912245 3.4E-01 -0.205487 0.215339 0.910592 3.4E-01 0.910551 3.4E-01
+
+        3. large file, use --bulk, the lines are processed by block and the output is tab delimited (the original line is kept as it is);
+            --pval-col 12 --cutoff 8 will only keep the lines with LOG10P (12th column of input) > 8 in the same pass
+            zcat _ldl_a.regenie.gz | snpID2bed.py -i 3 --no-chr --pval-col 12 --cutoff 8 > ldl_a.filter
         """
         ),
     )
@@ -92,43 +98,47 @@ def getParser():
         "--no-chr",dest="nochr",action="store_true",default=False,help="Remove 'chr' prefix in chromosome name."
     )
     parser.add_argument("--no-header", dest="noheader", action="store_true", default=False, help="No header in input file.")
+    parser.add_argument("--bulk", dest="bulk", action="store_true", default=False, help="Process lines by block, only split up to the ID column and output with tab.")
+    parser.add_argument("-p", "--pval-col", dest="pvalCol", type=int, default=None, help="Pvalue (LOG10P) column index of input, only keep lines with pvalue > --cutoff. Implies --bulk.")
+    parser.add_argument("--cutoff", dest="cutoff", type=float, default=0, help="cutoff for --pval-col, default 0.")
     # parser.add_argument()
     return parser
 
 
-def formatChr(x, nochr=False):
-    if nochr:
-        return x.replace("chr", "")
-    else:
-        if x.startswith("chr"):
-            return x
-        elif x.isdigit():
-            if int(x) < 23:
-                return "chr" + str(int(x))
-            else:
-                if x == "23":
-                    return "chrX"
-                elif x == "24":
-                    return "chrY"
-                elif x == "25":
-                    return "chrX"
-                elif x == "26":
-                    return "chrMT"
-        else:
-            return x
-
-
 def reformat(line, idCol=1, idSep=":", colSep=None, nochr=False):
     lineList = line.split(colSep)
     idList = lineList[idCol - 1].split(idSep)
     
-    idList[0] = formatChr(idList[0], nochr)
+    idList[0] = getChromTable("nochr" if nochr else "chr")[idList[0]]
 
     if colSep is None:
         colSep = " "
     return colSep.join([idList[0], idList[1], idList[1], idList[2], idList[3]] + lineList)
 
 
+def reformat_block(lines, idCol=1, idSep=":", colSep=None, chromTable=None, pvalCol=None, cutoff=None):
+    """
+    Bulk version of reformat for --bulk, returns the output text of a block of stripped lines.
+
+    Lines are only split up to the ID (and pvalue) column, the chr start end ref alt columns are added in front of
+    the original line with tabs. If pvalCol is given, only lines with float(pvalue) > cutoff are kept, lines with
+    a pvalue can not be parsed (like NA) are dropped.
+    """
+    maxsplit = max(idCol, pvalCol or 0)
+    out = []
+    for line in lines:
+        ss = line.split(colSep, maxsplit)
+        if pvalCol is not None:
+            try:
+                if not float(ss[pvalCol - 1]) > cutoff:
+                    continue
+            except ValueError:
+                continue
+        chr, pos, ref, alt = ss[idCol - 1].split(idSep, 4)[:4]
+        out.append(f"{chromTable[chr]}\t{pos}\t{pos}\t{ref}\t{alt}\t{line}\n")
+    return "".join(out)
+
+
 if __name__ == "__main__":
     parser = getParser()
     args = parser.parse_args()
@@ -138,18 +148,33 @@ if __name__ == "__main__":
     colSep = args.colSep
     nochr = args.nochr
 
-    idx = 1 # count for header 
-    for line in sys.stdin:
-        line = line.strip()
-        if line:
-            if idx == 1:  # header line
-                if not args.noheader: # defualt have header 
+    if args.bulk or args.pvalCol is not None:
+        chromTable = getChromTable("nochr" if nochr else "chr")
+        if not args.noheader:
+            for line in sys.stdin:
+                line = line.strip()
+                if line:
                     sys.stdout.write("chr\tstart\tend\tref\talt\t" + line + "\n")
-                    idx +=1
-                    continue 
-            ss = reformat(line, idCol, idSep, colSep, nochr)
-            sys.stdout.write(ss + "\n")
-            idx +=1
+                    break
+        while True:
+            lines = sys.stdin.readlines(1 << 20)
+            if not lines:
+                break
+            block = [line for line in (line.strip() for line in lines) if line]
+            sys.stdout.write(reformat_block(block, idCol, idSep, colSep, chromTable, args.pvalCol, args.cutoff))
+    else:
+        idx = 1 # count for header 
+        for line in sys.stdin:
+            line = line.strip()
+            if line:
+                if idx == 1:  # header line
+                    if not args.noheader: # defualt have header 
+                        sys.stdout.write("chr\tstart\tend\tref\talt\t" + line + "\n")
+                        idx +=1
+                        continue 
+                ss = reformat(line, idCol, idSep, colSep, nochr)
+                sys.stdout.write(ss + "\n")
+                idx +=1
 
 
 sys.stdout.close()